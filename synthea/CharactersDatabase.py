@@ -1,12 +1,84 @@
+from contextlib import contextmanager
 import re
 import sqlite3
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 from .character_errors import *
 
-conn = sqlite3.connect("mydata.db")
-
-char_id_PATTERN = r"^\w+$"  # The regex pattern for valid strings
-EDITABLE_COLUMNS = ["description", "display_name", "avatar_link", "system_prompt", "example_messages"]
+char_id_PATTERN: re.Pattern = re.compile(r"\w+")  # The regex pattern for valid strings
+EDITABLE_COLUMNS: frozenset[str] = frozenset(
+    {"description", "display_name", "avatar_link", "system_prompt", "example_messages"}
+)
+
+# sqlite caches compiled statements by their exact text, so each query is written once here
+# and reused every time it is run.
+GET_OWNER_QUERY = """
+    SELECT c.owner
+    FROM characters c
+    WHERE c.id = ?
+"""
+# returns no row if the character doesn't exist, otherwise whether the user owns it
+# or it was added to the server
+ACCESS_QUERY = """
+    SELECT c.owner = ? OR EXISTS (
+        SELECT 1
+        FROM server_characters sc
+        WHERE sc.char_id = c.id AND sc.server_id = ?
+    )
+    FROM characters c
+    WHERE c.id = ?
+"""
+LOAD_CHARACTER_QUERY = """
+    SELECT *
+    FROM characters c
+    WHERE c.id = ?
+"""
+CREATE_CHARACTER_QUERY = """
+    INSERT INTO characters (id, owner)
+    VALUES (?, ?)
+"""
+DELETE_CHARACTER_QUERY = """
+    DELETE FROM characters
+    WHERE id = ?
+"""
+# one query per column, since column names can't be bound as parameters
+UPDATE_QUERIES = {
+    column_name: f"""
+    UPDATE characters
+    SET {column_name} = ?
+    WHERE id = ?
+"""
+    for column_name in EDITABLE_COLUMNS
+}
+REMOVE_FROM_SERVER_QUERY = """
+    DELETE FROM server_characters
+    WHERE char_id = ? AND server_id = ?
+"""
+ADD_SERVER_QUERY = """
+    INSERT OR IGNORE INTO servers (server_id)
+    VALUES (?)
+"""
+ADD_TO_SERVER_QUERY = """
+    INSERT OR IGNORE INTO server_characters (char_id, server_id)
+    VALUES (?, ?)
+"""
+# lists are paged by the last id on the previous page, so each page starts with an index lookup
+# rather than stepping over every row on the pages before it.
+# an empty id comes before every character id, so it gets the first page.
+LIST_USER_CHARACTERS_QUERY = """
+    SELECT id, description, display_name
+    FROM characters
+    WHERE owner = ? AND id > ?
+    ORDER BY id ASC
+    LIMIT 5
+"""
+LIST_SERVER_CHARACTERS_QUERY = """
+    SELECT c.id, c.description, c.display_name
+    FROM server_characters sc
+    JOIN characters c ON c.id = sc.char_id
+    WHERE sc.server_id = ? AND sc.char_id > ?
+    ORDER BY sc.char_id ASC
+    LIMIT 5
+"""
 
 
 class CharactersDatabase:
@@ -15,8 +87,10 @@ class CharactersDatabase:
     create, update, and retrieve characters stored in the characters database.
 
     Attributes:
-        _conn (sqlite3.Connection): The SQLite database connection.
+        _conn (sqlite3.Connection): The SQLite database connection. All writes go through it.
         _cursor (sqlite3.Cursor): The cursor for executing SQL commands.
+        _read_conn (sqlite3.Connection): A read-only connection, used for queries
+            which don't change the database. Opened the first time it is needed.
     """
 
     def __init__(self, use_test=False):
@@ -34,9 +108,18 @@ class CharactersDatabase:
             db_file = "characters.db"
 
         # Connect to a database (or create it if it doesn't exist)
-        self._conn = sqlite3.connect(db_file)
+        self._db_file: str = db_file
+        # transactions are started explicitly by _write_txn, rather than implicitly by sqlite3
+        self._conn = sqlite3.connect(db_file, cached_statements=256, isolation_level=None)
         self._conn.row_factory = sqlite3.Row  # return rows as dicts
         self._conn.execute("PRAGMA foreign_keys = 1")  # enforce foreign keys
+        # write-ahead logging only syncs to disk at checkpoints rather than on every commit,
+        # and lets reads go on while a write is in progress.
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("PRAGMA temp_store = MEMORY")
+        self._conn.execute("PRAGMA cache_size = -64000")  # 64MB
+        self._conn.execute("PRAGMA mmap_size = 268435456")  # 256MB
         self._cursor = self._conn.cursor()
 
         # Create the tables if they don't exist
@@ -72,6 +155,46 @@ class CharactersDatabase:
             );
             """
         )
+        # lists of a user's characters are filtered by owner and sorted by id
+        self._cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_characters_owner ON characters (owner, id)"
+        )
+        # the primary key covers lookups by server, this covers lookups by character
+        self._cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_server_characters_char ON server_characters (char_id)"
+        )
+
+        # in WAL mode, reads on another connection don't wait for writes on this one
+        self._read_conn: Optional[sqlite3.Connection] = None
+
+    @contextmanager
+    def _write_txn(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Runs the statements in a with block as one transaction, which is committed
+        at the end of the block or rolled back if it raises.
+        The write lock is taken at the start, so the transaction never has to wait
+        for it halfway through.
+        """
+        self._cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._cursor
+        except BaseException:
+            self._cursor.execute("ROLLBACK")
+            raise
+        self._cursor.execute("COMMIT")
+
+    def _reader(self) -> sqlite3.Connection:
+        """
+        Gets the read-only connection to the database, opening it if needed.
+        """
+        if self._read_conn is None:
+            self._read_conn = sqlite3.connect(
+                f"file:{self._db_file}?mode=ro", uri=True, cached_statements=256
+            )
+            self._read_conn.row_factory = sqlite3.Row  # return rows as dicts
+            self._read_conn.execute("PRAGMA cache_size = -16000")  # 16MB
+            self._read_conn.execute("PRAGMA mmap_size = 268435456")  # 256MB
+        return self._read_conn
 
     def is_character_owner(self, char_id: str, user_id: int) -> bool:
         """
@@ -87,28 +210,20 @@ class CharactersDatabase:
         Raises:
             (CharacterNotFoundError): If no character by char_id is found in the DB.
         """
-        char_id = char_id.lower()
+        owner: int | None = self._get_owner(char_id.lower())
 
-        query = """
-            SELECT COUNT(*)
-            FROM characters c
-            WHERE c.id = ?
-        """
-        self._cursor.execute(query, (char_id,))
-        count = self._cursor.fetchone()[0]
-
-        if count == 0:
+        if owner is None:
             raise CharacterNotFoundError()
 
-        query = """
-            SELECT COUNT(*)
-            FROM characters c
-            WHERE c.id = ? AND c.owner = ?
-        """
-        self._cursor.execute(query, (char_id, user_id))
-        count = self._cursor.fetchone()[0]
+        return owner == user_id
 
-        return count > 0
+    def _get_owner(self, char_id: str) -> int | None:
+        """
+        Gets the user id of a character's owner, or None if the character doesn't exist.
+        Public methods lowercase char_id once when they are called, so it must be lowercase already.
+        """
+        row = self._reader().execute(GET_OWNER_QUERY, (char_id,)).fetchone()
+        return row[0] if row else None
 
     def can_access_character(
         self,
@@ -130,27 +245,20 @@ class CharactersDatabase:
                 If this is in a DM, leave it as None.
         Raises:
             (ValueError): If neither a user_id nor a server_id was passed.
+            (CharacterNotFoundError): If no character by char_id is found in the DB.
         """
         char_id = char_id.lower()
         if not user_id and not server_id:
             raise ValueError("No user_id or server_id to check character access rights")
 
-        if server_id:
-            # any user can access a character who has been added to a server
-            query = """
-                SELECT COUNT(*)
-                FROM characters c
-                JOIN server_characters sc ON c.id = sc.char_id
-                WHERE c.id = ? AND (sc.server_id = ? OR c.owner = ?)
-            """
-            self._cursor.execute(query, (char_id, server_id, user_id))
-            count = self._cursor.fetchone()[0]
+        # Owners can always access their character, whether in DMs or on servers.
+        # any user can access a character who has been added to a server
+        row = self._reader().execute(ACCESS_QUERY, (user_id, server_id, char_id)).fetchone()
 
-            if count > 0:
-                return True
+        if row is None:
+            raise CharacterNotFoundError()
 
-        # Owners can always access their character, whether in DMs or on servers
-        return self.is_character_owner(char_id, user_id)
+        return bool(row[0])
 
     def load_character(
         self,
@@ -163,35 +271,44 @@ class CharactersDatabase:
         If the character doesn't exist, returns None.
         """
         char_id = char_id.lower()
-        query = """
-            SELECT *
-            FROM characters c
-            WHERE c.id = ?
-        """
-        self._cursor.execute(query, (char_id,))
-        rows = self._cursor.fetchall()
-        return dict(rows[0]) if rows else None
+        row = self._reader().execute(LOAD_CHARACTER_QUERY, (char_id,)).fetchone()
+        return dict(row) if row else None
 
     def create_character(self, char_id: str, user_id: int):
         """
         Adds a character to the database.
         """
-        char_id = char_id.lower()
-        # check if the character exists
-        if self.load_character(char_id):
-            raise DuplicateCharacterError()
-        # make sure the character ID conforms to our requirements.
-        if not re.match(char_id_PATTERN, char_id):
-            raise InvalidCharacterIDError()
-
-        query = """
-            INSERT INTO characters (id, owner)
-            VALUES (?, ?)
-            """
+        self.create_characters([(char_id, user_id)])
+
+    def create_characters(self, characters: list[tuple[str, int]]):
+        """
+        Adds several characters to the database at once. Either all of the
+        characters are added, or none of them are.
 
-        # add a new character.
-        self._cursor.execute(query, (char_id, user_id))
-        self._conn.commit()
+        Args:
+            characters (list of (str, int)): The id and owner's user id of each character.
+        Raises:
+            (InvalidCharacterIDError): If any character id is invalid.
+            (DuplicateCharacterError): If any of the characters exists already.
+        """
+        rows: list[tuple[str, int]] = []
+        for char_id, user_id in characters:
+            char_id = char_id.lower()
+            # make sure the character ID conforms to our requirements.
+            # this is checked first since it doesn't need the database.
+            if not char_id_PATTERN.fullmatch(char_id):
+                raise InvalidCharacterIDError()
+            rows.append((char_id, user_id))
+
+        # add the new characters. The primary key rejects any that exist already.
+        try:
+            with self._write_txn():
+                self._cursor.executemany(CREATE_CHARACTER_QUERY, rows)
+        except sqlite3.IntegrityError as err:
+            if err.sqlite_errorname == "SQLITE_CONSTRAINT_PRIMARYKEY":
+                # pylint: disable-next=raise-missing-from
+                raise DuplicateCharacterError()
+            raise
 
     def delete_character(self, char_id: str, user_id: int):
         """
@@ -206,20 +323,15 @@ class CharactersDatabase:
             (ForbiddenCharacterError): If the user doesn't own this character
         """
         char_id = char_id.lower()
-        char = self.load_character(char_id)
-        if not char:
+        owner: int | None = self._get_owner(char_id)
+        if owner is None:
             raise CharacterNotFoundError()
-        elif char["owner"] != user_id:
+        if owner != user_id:
             raise ForbiddenCharacterError()
 
-        query = """
-                DELETE FROM characters
-                WHERE id = ?
-            """
-
-        # add a new character.
-        self._cursor.execute(query, (char_id,))
-        self._conn.commit()
+        # delete the character.
+        with self._write_txn():
+            self._cursor.execute(DELETE_CHARACTER_QUERY, (char_id,))
 
     def update_character(
         self, char_id: str, user_id: int, column_name: str, new_value: Any
@@ -229,26 +341,19 @@ class CharactersDatabase:
         by the user.
         """
         char_id = char_id.lower()
-        char = self.load_character(char_id)
-        if not char:
+        owner: int | None = self._get_owner(char_id)
+        if owner is None:
             raise CharacterNotFoundError()
-        elif char["owner"] != user_id:
+        if owner != user_id:
             raise ForbiddenCharacterError()
 
         # Check if the column name is editable
-        if column_name not in EDITABLE_COLUMNS:
+        if column_name not in UPDATE_QUERIES:
             raise ValueError(f"Invalid column name {column_name}")
 
-        # Prepare the SQL query
-        query = f"""
-            UPDATE characters
-            SET {column_name} = ?
-            WHERE id = ?
-        """
-
         # Execute the query
-        self._cursor.execute(query, (new_value, char_id))
-        self._conn.commit()
+        with self._write_txn():
+            self._cursor.execute(UPDATE_QUERIES[column_name], (new_value, char_id))
 
     def remove_character_from_server(self, char_id: str, user_id: int, server_id: int):
         """
@@ -257,18 +362,14 @@ class CharactersDatabase:
         """
         char_id = char_id.lower()
         # make sure the character exists and the user can edit it.
-        char = self.load_character(char_id)
-        if not char:
+        owner: int | None = self._get_owner(char_id)
+        if owner is None:
             raise CharacterNotFoundError()
-        if not self.is_character_owner(char_id, user_id):
+        if owner != user_id:
             raise ForbiddenCharacterError()
 
-        query = """
-            DELETE FROM server_characters
-            WHERE char_id = ? AND server_id = ?
-            """
-        self._cursor.execute(query, (char_id, server_id))
-        self._conn.commit()
+        with self._write_txn():
+            self._cursor.execute(REMOVE_FROM_SERVER_QUERY, (char_id, server_id))
 
     def add_character_to_server(self, char_id: str, user_id: int, server_id: int):
         """
@@ -282,72 +383,59 @@ class CharactersDatabase:
         """
         char_id = char_id.lower()
         # make sure the character exists and the user can edit it.
-        char = self.load_character(char_id)
-        if not char:
+        owner: int | None = self._get_owner(char_id)
+        if owner is None:
             raise CharacterNotFoundError()
-        if not self.is_character_owner(char_id, user_id):
+        if owner != user_id:
             raise ForbiddenCharacterError()
 
-        # add server to list of servers the bot is on
-        query = """
-            INSERT OR IGNORE INTO servers (server_id)
-            VALUES (?)
-            """
-        self._cursor.execute(query, (server_id,))
-        query = """
-            INSERT OR IGNORE INTO server_characters (char_id, server_id)
-            VALUES (?, ?)
-            """
-        self._cursor.execute(query, (char_id, server_id))
-        self._conn.commit()
+        # add server to list of servers the bot is on, then add the character to it.
+        # both inserts are committed together, or rolled back together if either fails.
+        with self._write_txn():
+            self._cursor.execute(ADD_SERVER_QUERY, (server_id,))
+            self._cursor.execute(ADD_TO_SERVER_QUERY, (char_id, server_id))
 
-    def list_user_characters(self, user_id: int, offset=0):
+    def list_user_characters(self, user_id: int, after_id: Optional[str] = None):
         """
         Returns a list of the characters a user owns along with descriptions,
-        if any.
+        if any. At most 5 characters are returned at a time, sorted by id.
 
         Args:
             user_id (int): The user to list owned characters from
+            after_id (str, optional): The id of the last character on the previous page.
+                Leave it as None to get the first page.
         """
-        # TODO: Limit and paginate this
-        query = """
-            SELECT id, description, display_name
-            FROM characters
-            WHERE owner = ?
-            ORDER BY id ASC
-            LIMIT 5
-            OFFSET ?
-            """
-        self._cursor.execute(query, (user_id, offset))
-        name_list = [dict(row) for row in self._cursor.fetchall()]
+        rows = self._reader().execute(LIST_USER_CHARACTERS_QUERY, (user_id, after_id or "")).fetchall()
+        name_list = [dict(row) for row in rows]
         return name_list
 
-    def list_server_characters(self, server_id: int, offset=0) -> list[dict[str, str]]:
+    def list_server_characters(self, server_id: int, after_id: Optional[str] = None) -> list[dict[str, str]]:
         """
         Returns a list of the characters on a server along with descriptions,
-        if any.
+        if any. At most 5 characters are returned at a time, sorted by id.
 
         Args:
-            char_id (str): The character to add.
             server_id (int): The server to list characters from
+            after_id (str, optional): The id of the last character on the previous page.
+                Leave it as None to get the first page.
         """
-        # TODO: Limit and paginate this
-        query = """
-            SELECT c.id, c.description, c.display_name
-            FROM characters c
-            JOIN server_characters sc ON sc.char_id = c.id
-            WHERE server_id = ?
-            ORDER BY c.id ASC
-            LIMIT 5
-            OFFSET ?
-            """
-        self._cursor.execute(query, (server_id, offset))
-        name_list = [dict(row) for row in self._cursor.fetchall()]
+        rows = self._reader().execute(LIST_SERVER_CHARACTERS_QUERY, (server_id, after_id or "")).fetchall()
+        name_list = [dict(row) for row in rows]
         return name_list
 
-    def __del__(self):
+    def close(self):
         """
-        When the CharacterManager is deleted, clean up DB objects
+        Closes the database. The write-ahead log is checkpointed into the database
+        first, so it doesn't grow from one run of the bot to the next.
+        Closing a database which is already closed does nothing.
         """
-        if self._conn:
-            self._conn.close()
+        if self._conn is None:
+            return
+        if self._read_conn is not None:
+            self._read_conn.close()
+            self._read_conn = None
+        self._cursor.close()
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.close()
+        self._conn = None
+        self._cursor = None
@@ -1,6 +1,5 @@
 import argparse
 from typing import IO, NoReturn
-import yaml
 
 from synthea.Config import Config
 
@@ -49,55 +48,123 @@ class ParsedArgs:
         self.use_image_model: bool = use_image_model
         self.prompt: str = prompt
 
+
+def _build_parser() -> CommandParser:
+    """
+    Builds the argparse parser for bot commands.
+    """
+    parser = CommandParser(
+        exit_on_error=False,
+        prog="!syn",
+        description="This bot is an interface for chatting with large language models.",
+        add_help=True,
+    )
+    parser.add_argument(
+        "-c",
+        "-char",
+        "--character",
+        action="store",
+        default=None,
+        help="The character for the bot to assume in its response.",
+    )
+    parser.add_argument(
+        "-im",
+        "--use-image-model",
+        action="store_true",
+        default=None,
+        dest="use_image_model",
+        help="Use the image model to generate the response.",
+    )
+    parser.add_argument(
+        "-sp",
+        "-system-prompt",
+        "--use-as-system-prompt",
+        action="store_true",
+        default=None,
+        dest="use_as_system_prompt",
+        help="Save the prompt text as the system prompt for the remainder of the reply chain.",
+    )
+    parser.add_argument(
+        "prompt", nargs=argparse.REMAINDER, help="The prompt to give the bot."
+    )
+    return parser
+
+
+# parsing doesn't change the parser, so every ChatbotParser shares this one
+_PARSER: CommandParser = _build_parser()
+
+# the options which ChatbotParser reads without argparse. Keep these in sync with _build_parser.
+_CHARACTER_OPTIONS: frozenset[str] = frozenset({"-c", "-char", "--character"})
+_IMAGE_MODEL_OPTIONS: frozenset[str] = frozenset({"-im", "--use-image-model"})
+_SYSTEM_PROMPT_OPTIONS: frozenset[str] = frozenset({"-sp", "-system-prompt", "--use-as-system-prompt"})
+
+
 class ChatbotParser:
     def __init__(self):
-        self.parser = CommandParser(
-            exit_on_error=False,
-            prog="!syn",
-            description="This bot is an interface for chatting with large language models.",
-            add_help=True,
-        )
-        self.parser.add_argument(
-            "-c",
-            "-char",
-            "--character",
-            action="store",
-            default=None,
-            help="The character for the bot to assume in its response.",
-        )
-        self.parser.add_argument(
-            "-im",
-            "--use-image-model",
-            action="store_true",
-            default=None,
-            dest="use_image_model",
-            help="Use the image model to generate the response.",
-        )
-        self.parser.add_argument(
-            "-sp",
-            "-system-prompt",
-            "--use-as-system-prompt",
-            action="store_true",
-            default=None,
-            dest="use_as_system_prompt",
-            help="Save the prompt text as the system prompt for the remainder of the reply chain.",
-        )
-        self.parser.add_argument(
-            "prompt", nargs=argparse.REMAINDER, help="The prompt to give the bot."
-        )
+        self.parser = _PARSER
 
         # load config
         self.config = Config()
+        # precomputed so checking for a command doesn't lowercase the whole message
+        self._command_start: str = self.config.command_start_str.lower()
+        self._command_start_len: int = len(self._command_start)
+
+    def is_command(self, text: str) -> bool:
+        """
+        Checks if a message starts with the command start string, ignoring case.
+        """
+        return text[:self._command_start_len].lower() == self._command_start
 
     def parse(self, command: str) -> ParsedArgs:
         """
         Parses a command given by the user.
         """
         # remove the command start string if it was present.
-        if command.lower().startswith(self.config.command_start_str.lower()):
-            command = command[len(self.config.command_start_str):]
-
-        # convert the parsed args into an object for better type matching
-        args: ParsedArgs = self.parser.parse_args(command.split(), namespace=ParsedArgs())
-        args.prompt = " ".join(args.prompt)
+        if self.is_command(command):
+            command = command[self._command_start_len:]
+
+        tokens: list[str] = command.split()
+        fast_parsed = self._fast_parse(tokens)
+        if fast_parsed:
+            args, options_count = fast_parsed
+        else:
+            # convert the parsed args into an object for better type matching
+            args = self.parser.parse_args(tokens, namespace=ParsedArgs())
+            options_count = len(tokens) - len(args.prompt)
+
+        # the prompt is the rest of the command after the options, so take it from the command
+        # itself rather than joining the words back together. This keeps its line breaks.
+        if options_count < len(tokens):
+            args.prompt = command.split(None, options_count)[-1].strip()
+        else:
+            args.prompt = ""
         return args
+
+    def _fast_parse(self, tokens: list[str]) -> tuple[ParsedArgs, int] | None:
+        """
+        Reads the options at the start of a command without argparse. Options can only
+        come before the prompt, so this stops at the first word that isn't an option.
+
+        Returns:
+            A tuple of the parsed options and how many words they took up, or None
+            if the command has anything which needs argparse, like help or an invalid option.
+        """
+        args: ParsedArgs = ParsedArgs()
+        index: int = 0
+        while index < len(tokens) and tokens[index].startswith("-"):
+            token: str = tokens[index]
+            if token in _CHARACTER_OPTIONS:
+                # argparse reports a missing character, so leave that to it
+                if index + 1 >= len(tokens) or tokens[index + 1].startswith("-"):
+                    return None
+                args.character = tokens[index + 1]
+                index += 2
+            elif token in _IMAGE_MODEL_OPTIONS:
+                args.use_image_model = True
+                index += 1
+            elif token in _SYSTEM_PROMPT_OPTIONS:
+                args.use_as_system_prompt = True
+                index += 1
+            else:
+                return None
+        return args, index
@@ -1,18 +1,58 @@
+import os
+from typing import Any, Optional
 import yaml
 
+try:
+    # libyaml's C loader is several times faster than the pure python loader
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# parsed yaml files, keyed by path, along with the modification time of the file when it was parsed
+_YAML_CACHE: dict[str, tuple[float, Any]] = {}
+
+
+def load_yaml_cached(path: str) -> Any:
+    """
+    Loads a yaml file, only parsing it again if the file changed since it was last loaded.
+    The same object is returned each time the file is loaded, so it must not be modified.
+
+    Args:
+        path (str): The path to the yaml file
+    """
+    mtime: float = os.path.getmtime(path)
+    cached = _YAML_CACHE.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "r", encoding="utf-8") as file:
+        loaded_file = yaml.load(file, Loader=YamlLoader)
+    _YAML_CACHE[path] = (mtime, loaded_file)
+    return loaded_file
+
 
 class Config:  
     """
     A simple class for storing and loading config.yaml
     """
-    def __init__(self):
+    # the config returned by Config.get, and the parsed file it was built from
+    _shared: Optional["Config"] = None
+    _shared_source: Any = None
+
+    def __init__(self, loaded_file: Optional[dict[str, Any]] = None):
         """
         Load config.yaml and parse it into the class fields
+
+        Args:
+            loaded_file (dict, optional): The parsed contents of config.yaml.
+                config.yaml is loaded if this isn't given.
         """
-        with open("config.yaml", "r", encoding="utf-8") as file:
-            loaded_file: dict[str, str] = yaml.safe_load(file)
+        if loaded_file is None:
+            loaded_file = load_yaml_cached("config.yaml")
         self.context_length: int = loaded_file["context_length"]
         self.max_new_tokens: int = loaded_file["max_new_tokens"]
+        # the tokens left for the chat history once room is made for the response
+        self.history_token_limit: int = self.context_length - self.max_new_tokens
         self.command_start_str: str = loaded_file["command_start_str"]
         self.system_prompt: str = loaded_file["system_prompt"]
         self.default_model: str = loaded_file["default_model"]
@@ -39,3 +79,17 @@ class Config:
         self.image_system_prompt: str = loaded_file["image_system_prompt"]
         self.image_question_prompt: str = loaded_file["image_question_prompt"]
         self.image_processing_enabled: bool = loaded_file["image_processing_enabled"]
+
+    @classmethod
+    def get(cls) -> "Config":
+        """
+        Gets a config shared by every caller, which is only rebuilt once config.yaml changes.
+        Checking for changes costs a single stat of the file, so this can be called on every request.
+        The shared config must not be modified.
+        """
+        loaded_file: dict[str, Any] = load_yaml_cached("config.yaml")
+        # load_yaml_cached returns the same object until the file changes
+        if cls._shared is None or cls._shared_source is not loaded_file:
+            cls._shared = cls(loaded_file)
+            cls._shared_source = loaded_file
+        return cls._shared
@@ -3,19 +3,23 @@
 Generate a prompt for the AI to respond to, given the
 message history and persona.
 """
+import asyncio
+from collections import OrderedDict, deque
+import io
+import logging
 from typing import AsyncIterator, Optional
 import discord
 import pypdf
-from jinja2 import Environment
-import os
-import yaml
 
 from synthea.CharactersDatabase import CharactersDatabase
 from synthea.CommandParser import ChatbotParser, CommandError, ParsedArgs, ParserExitedException
 from synthea import SyntheaClient
 from synthea.Config import Config
-from synthea.VisionModel import VisionModel
-from synthea.LanguageModel import LanguageModel
+from synthea.MessageCache import MessageCache
+from synthea.SyntheaUtilities import compile_template
+
+logger = logging.getLogger(__name__)
+
 
 class ReplyChainIterator:
     """
@@ -23,8 +27,14 @@ class ReplyChainIterator:
     or fails to capture the last message.
     """
 
-    def __init__(self, starting_message: discord.Message):
+    def __init__(self, starting_message: discord.Message, message_cache: Optional[MessageCache] = None):
+        """
+        starting_message (discord.Message): The message at the end of the reply chain.
+        message_cache (MessageCache, optional): Where to fetch the earlier messages in the chain from.
+            A cache only used for this chain is made if this isn't given.
+        """
         self.message = starting_message
+        self.message_cache: MessageCache = message_cache or MessageCache()
         self.message_index = 0
 
     def __aiter__(self):
@@ -38,16 +48,16 @@ class ReplyChainIterator:
         if self.message.reference:
             self.message_index += 1
             try:
-                self.message = await self.message.channel.fetch_message(
-                    self.message.reference.message_id
-                )
-                return self.message
-
+                parent: discord.Message | None = await self.message_cache.fetch_replied_message(self.message)
             except (discord.NotFound, discord.HTTPException, discord.Forbidden):
                 # the user may have deleted their message
                 # either way, we can't follow the history anymore
                 # pylint: disable-next=raise-missing-from
                 raise StopAsyncIteration
+            if not parent:
+                raise StopAsyncIteration
+            self.message = parent
+            return self.message
         else:
             raise StopAsyncIteration
 
@@ -59,18 +69,33 @@ class ContextManager:
 
     # A rough measure of how many character are in each token.
     EST_CHARS_PER_TOKEN: int = 3
+    # How many attachments to keep the text of, so they aren't downloaded again for every response.
+    ATTACHMENT_CACHE_SIZE: int = 64
 
-    def __init__(self, bot_user_id: int):
+    def __init__(
+        self,
+        bot_user_id: int,
+        characters_database: CharactersDatabase,
+        parser: Optional[ChatbotParser] = None,
+        message_cache: Optional[MessageCache] = None,
+    ):
         """
         model (str): The model that is generating the text. Used to determine the prompt format
             and other configuration options.
         bot_user_id (str): The discord user id of the bot. Used to determine if a message came from
             the bot or from a user.
+        characters_database (CharactersDatabase): The database to look up the characters in the
+            chat history from. The client owns it and closes it when the bot stops.
+        parser (ChatbotParser, optional): The parser used to read commands in the chat history.
+            Pass the client's parser to share it instead of building another one.
+        message_cache (MessageCache, optional): The cache to fetch the messages in reply chains from.
+            Pass the client's cache so that edited and deleted messages are dropped from it.
         """
-        self.parser: ChatbotParser = ChatbotParser()
-        self.image_model: VisionModel = VisionModel()
-        self.language_model: LanguageModel = LanguageModel()
-        self.characters_database: CharactersDatabase = CharactersDatabase()
+        self.parser: ChatbotParser = parser if parser else ChatbotParser()
+        self.message_cache: MessageCache = message_cache if message_cache else MessageCache()
+        # the text of attachments which were already read, keyed by attachment id
+        self._attachment_texts: OrderedDict[int, str] = OrderedDict()
+        self.characters_database: CharactersDatabase = characters_database
         self.bot_user_id: int = bot_user_id
 
     async def generate_chat_history_from_chat(
@@ -90,7 +115,7 @@ class ContextManager:
             args: a ParsedArgs representing the most recent command in the
                 chat history 
         """
-        history_iterator: ReplyChainIterator = ReplyChainIterator(message)
+        history_iterator: ReplyChainIterator = ReplyChainIterator(message, self.message_cache)
         chat_history, args = await self.compile_chat_history(
             message=message,
             history_iterator=history_iterator,
@@ -100,7 +125,7 @@ class ContextManager:
         return chat_history, args
 
 
-    async def convert_chat_history_to_prompt(self, chat_history: list[dict[str, str]], chat_template: str) -> str:
+    def convert_chat_history_to_prompt(self, chat_history: list[dict[str, str]], chat_template: str) -> str:
         """
         Takes a chat template and converts it to a prompt. 
 
@@ -109,11 +134,8 @@ class ContextManager:
                 Refer to huggingface's chat template feature for information on how this should be formatted.
             chat_template (str): The jinja2 chat template to apply to the chat history.
         """
-        chat_template = "{% for message in messages %}{% if message['role'] == 'user' %}{{ '### Instruction:\\n' + message['content'].strip()}}{% elif message['role'] == 'system' %}{{ message['content'].strip() }}{% elif message['role'] == 'assistant' %}{{ '### Response\\n'  + message['content'] }}{% endif %}{{'\\n\\n'}}{% endfor %}{{ '### Response:\\n' }}"
-
-        # Create a Jinja2 environment and compile the template
-        env = Environment()
-        template = env.from_string(chat_template)
+        # the template is only compiled the first time it is used
+        template = compile_template(chat_template)
 
         # Render the template with your messages
         formatted_chat = template.render(messages=chat_history)
@@ -141,26 +163,37 @@ class ContextManager:
         Returns:
 
         """
-        config = Config()
+        config = Config.get()
 
-        # pieces of the prompts are appended to the list then assembled in reverse order into the final prompt
+        # the history is read newest first, so each message goes in front of the ones after it
         token_count: int = 0
         last_command_args: ParsedArgs | None = None
         system_prompt = None
-
-        # use provided system prompt
-        messages = []
+        history: deque[dict] = deque()
+        # the display names of the characters in this history, so each character is only loaded once
+        character_names: dict[str, str] = {}
 
         # retrieve as many tokens as can fit into the context length from history
-        history_token_limit: int = config.context_length - config.max_new_tokens
+        history_token_limit: int = config.history_token_limit
         system_prompt_tokens: int = len(default_system_prompt) // self.EST_CHARS_PER_TOKEN
         token_count += system_prompt_tokens
         async for message in history_iterator:
+            # the message's own text is cheap to measure, so if it can't fit, stop before downloading
+            # its attachments. commands are only measured once parsed, and system messages are skipped anyway
+            message_text: str = self._get_message_text(message)
+            if (
+                len(message_text) // self.EST_CHARS_PER_TOKEN + token_count > history_token_limit
+                and not self.parser.is_command(message_text)
+                and not self._is_system_message(message)
+            ):
+                break
+
             # some messages in the chain may be commands for the bot
             # if so, parse only the prompt in each command in order to not confuse the bot
-            content, added_tokens = await self._get_content(message, history_token_limit - token_count, config)
-            text: str = self._extract_text_from_content(content)
-            if text.lower().startswith(config.command_start_str.lower()):
+            content, text, added_tokens = await self._get_content(
+                message, message_text, history_token_limit - token_count, config
+            )
+            if self.parser.is_command(text):
                 message_args: ParsedArgs = self.parser.parse(text)
                 if not last_command_args:
                     last_command_args = message_args
@@ -170,11 +203,11 @@ class ContextManager:
                     continue
                 # clean the command to only include the prompt parameter
                 # TODO: support including images in these commands
-                content = [{"type": "text", "text": f"{message_args.prompt}"}]
+                content = [{"type": "text", "text": message_args.prompt}]
                 added_tokens = len(message_args.prompt) // self.EST_CHARS_PER_TOKEN
 
             # skip messages that were created by the system
-            if message.author.id == self.bot_user_id and message.embeds and message.embeds[0].footer.text == SyntheaClient.SYSTEM_TAG:
+            if self._is_system_message(message):
                 continue
 
             # don't include empty messages so the bot doesn't get confused.
@@ -186,13 +219,13 @@ class ContextManager:
                 break
 
             # add the username
-            self._inject_username(message, content)
+            self._inject_username(message, content, character_names)
 
             # update the prompt with this message
             if message.author.id == self.bot_user_id:
-                messages.insert(0, {"role": "assistant", "content": content})
+                history.appendleft({"role": "assistant", "content": content})
             else:
-                messages.insert(0, {"role": "user", "content": content})
+                history.appendleft({"role": "user", "content": content})
             
             token_count += added_tokens
 
@@ -202,16 +235,16 @@ class ContextManager:
             system_prompt = default_system_prompt
         if config.use_tools:
             system_prompt += f"\n{config.tool_prompt}"
-        messages.insert(0, {"role": "system", "content": [
-                    {"type": "text", "text": (system_prompt if system_prompt else default_system_prompt)}
-                    ]})
+        messages = [{"role": "system", "content": [{"type": "text", "text": system_prompt}]}]
+        messages.extend(history)
 
         return messages, last_command_args
     
-    async def _read_attachment(self, attachment: discord.Attachment) -> tuple[str, str] | None:
+    async def _read_attachment(self, attachment: discord.Attachment, config: Config) -> tuple[str, str] | None:
         """
         Args:
             attachment: The attachment to read 
+            config: The config for the bot
         Returns:
             (openai_content_type, attachment_string)
             A tuple with the openai type of the contents of the image, and a string representing it.
@@ -221,62 +254,125 @@ class ContextManager:
             ("text", "This is the content of the PDF")
             ("image_url", "https://images.freeimages.com/images/large-previews/cd7/gingko-biloba-1058537.jpg")
         """
-        config = Config()
         openai_content_type = ""
         attachment_string = ""
-        attachment_bytes = await attachment.read()
-        if not attachment.content_type or attachment.content_type.startswith("text/"):
+        if (
+            not attachment.content_type
+            or attachment.content_type.startswith("text/")
+            or "application/pdf" in attachment.content_type
+        ):
             openai_content_type = "text"
-            attachment_string = attachment_bytes.decode()
-        elif "application/pdf" in attachment.content_type:
-            print("Saving the pdf attachment")
-            openai_content_type = "text"
-            await attachment.save(attachment.filename)
-            reader = pypdf.PdfReader(attachment.filename)
-
-            print(f"Found {len(reader.pages)} pages in PDF. Reading them.")
-            for page in reader.pages:
-                page_text = page.extract_text()
-                attachment_string = attachment_string + "\n" + page_text
-            
-            print("Removing the saved file")
-            os.remove(attachment.filename)
+            attachment_string = await self._read_attachment_text(attachment)
         elif attachment.content_type.startswith("image/"):
             if not config.image_processing_enabled:
                 return None
-            print("Found image attachment")
+            logger.debug("Found image attachment")
             # just incldue the image url
             openai_content_type = "image_url"
             attachment_string = attachment.url
 
-        print(f"Obtained the text from the [{attachment.content_type}] attachment as a string")
-        print(f"Recorded as ({openai_content_type}, {attachment_string})")
+        logger.debug("Obtained the text from the [%s] attachment as a string", attachment.content_type)
+        logger.debug("Recorded as (%s, %s)", openai_content_type, attachment_string)
         return (openai_content_type, attachment_string)
 
+    async def _read_attachment_text(self, attachment: discord.Attachment) -> str:
+        """
+        Downloads a text or PDF attachment and extracts its text.
+        An attachment can't be changed once it is sent, so each one is only downloaded once
+        and its text is reused when the same reply chain is read again.
+        """
+        cached: str | None = self._attachment_texts.get(attachment.id)
+        if cached is not None:
+            self._attachment_texts.move_to_end(attachment.id)
+            return cached
+
+        attachment_bytes = await attachment.read()
+        if attachment.content_type and "application/pdf" in attachment.content_type:
+            # parsing a pdf can take a while, so don't hold up the event loop while doing it
+            text = await asyncio.to_thread(self._read_pdf, attachment_bytes)
+        else:
+            text = attachment_bytes.decode()
+
+        self._attachment_texts[attachment.id] = text
+        if len(self._attachment_texts) > self.ATTACHMENT_CACHE_SIZE:
+            self._attachment_texts.popitem(last=False)
+        return text
+
+    def _read_pdf(self, pdf_bytes: bytes) -> str:
+        """
+        Extracts the text from each page of a pdf.
+        """
+        reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+
+        logger.debug("Found %d pages in PDF. Reading them.", len(reader.pages))
+        return "".join("\n" + page.extract_text() for page in reader.pages)
+
     async def _get_linked_content(self, message: discord.Message, remaining_tokens: int, config: Config) -> tuple[list[dict[str, str]], int]:
         """
         Gets 
         """
 
-    async def _get_content(self, message: discord.Message, remaining_tokens: int, config: Config) -> tuple[list[dict[str, str]], int]:
+    def _get_message_text(self, message: discord.Message) -> str:
         """
-        Gets the text from a message and counts the tokens.
+        Gets the text of a message, without any of its attachments.
         """
-        contents: list[dict[str, str]] = []
-        tokens = 0
         # when the bot plays characters, it stores text in embeds rather than content
         if message.author.id == self.bot_user_id and message.embeds:
-            text = message.embeds[0].description
-        else:
-            text = message.clean_content
+            # an embed may have no description
+            return message.embeds[0].description or ""
+        return message.clean_content
+
+    def _is_system_message(self, message: discord.Message) -> bool:
+        """
+        Checks if a message was created by the system rather than written by a user or the bot.
+        """
+        return bool(
+            message.author.id == self.bot_user_id
+            and message.embeds
+            and message.embeds[0].footer.text == SyntheaClient.SYSTEM_TAG
+        )
+
+    async def _get_content(
+        self, message: discord.Message, text: str, remaining_tokens: int, config: Config
+    ) -> tuple[list[dict[str, str]], str, int]:
+        """
+        Gets the text from a message and counts the tokens.
 
-        message_content = {"type": "text", "text": f"{text}"}
+        Args:
+            message (discord.Message): The message to get the content of
+            text (str): The text of the message, from _get_message_text
+            remaining_tokens (int): How many tokens are left for the message's attachments
+            config (Config): The config for the bot
+        Returns:
+            A tuple of (contents, text, tokens)
+            contents: the openai compatible contents of the message
+            text: all of the text in the contents, joined together
+            tokens: an estimate of how many tokens the contents take up
+        """
+        contents: list[dict[str, str]] = []
+        tokens = 0
+        message_content = {"type": "text", "text": text}
         contents.append(message_content)
         tokens += len(message_content["text"]) // self.EST_CHARS_PER_TOKEN
 
-        # Iterate through any attachments associated with the message
-        for attachment in message.attachments:
-            attachment_contents = await self._read_attachment(attachment)
+        # download the attachments all at once rather than one after another
+        results = await asyncio.gather(
+            *(self._read_attachment(attachment, config) for attachment in message.attachments),
+            return_exceptions=True
+        )
+        for attachment, attachment_contents in zip(message.attachments, results):
+            # a failed download or a file that isn't text is the user's to know about, as before
+            if isinstance(attachment_contents, (discord.HTTPException, UnicodeDecodeError)):
+                raise attachment_contents
+            if isinstance(attachment_contents, Exception):
+                logger.warning(
+                    "Could not read the attachment %s", attachment.filename, exc_info=attachment_contents
+                )
+                # tell the bot that the file couldn't be read, rather than passing it off as empty
+                content = {"type": "text", "text": f"\n\nSYSTEM: A file called {attachment.filename} was attached to this message, but it could not be read."}
+                tokens += len(content["text"]) // self.EST_CHARS_PER_TOKEN
+                contents.append(content)
+                continue
             if not attachment_contents:
                 continue
             openai_content_type, attachment_content = attachment_contents
@@ -295,26 +391,27 @@ class ContextManager:
                 tokens += len(content["text"]) // self.EST_CHARS_PER_TOKEN
             contents.append(content)
 
-        return contents, tokens
-    
-    def _extract_text_from_content(self, content: list[dict[str, str]]) -> str:
-        text = ""
-        for entry in content:
-            if entry["type"] == "text":
-                text += entry["text"]
-        return text
+        text = "".join(entry["text"] for entry in contents if entry["type"] == "text")
+        return contents, text, tokens
 
-    def _inject_username(self, message: discord.Message, content: list[dict[str, str]]):
+    def _inject_username(self, message: discord.Message, content: list[dict[str, str]], character_names: dict[str, str]):
         """
         Adds text that says "Message from [User]" to a content list
+
+        Args:
+            character_names (dict of str to str): The display names of characters which were
+                already loaded, keyed by character id. Characters which are loaded are added to it.
         """
         # inject the character's name if they are a character
         if message.author.id == self.bot_user_id and message.embeds and message.embeds[0].footer.text:
-            char_data: dict[str, str] = self.characters_database.load_character(message.embeds[0].footer.text)                
-            content.insert(0, {"type": "text", "text": f"{char_data["display_name"]}: "})
+            char_id: str = message.embeds[0].footer.text
+            if char_id not in character_names:
+                char_data: dict[str, str] = self.characters_database.load_character(char_id)
+                character_names[char_id] = char_data["display_name"]
+            content.insert(0, {"type": "text", "text": f"{character_names[char_id]}: "})
         # inject You if no character is specified
         elif message.author.id == self.bot_user_id:
-            content.insert(0, {"type": "text", "text": f"You: "})
+            content.insert(0, {"type": "text", "text": "You: "})
             # TODO: Figure out how to square this with -sp
         # if another user inject the user's name into the prompt so the bot knows it
         else:
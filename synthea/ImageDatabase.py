@@ -1,20 +1,34 @@
+from functools import cached_property
 import re
 import sqlite3
 from typing import Any, Optional
 from .character_errors import *
 
-conn = sqlite3.connect("images.db")
-
 char_id_PATTERN = r"^\w+$"  # The regex pattern for valid strings
 EDITABLE_COLUMNS = ["description", "display_name", "avatar_link", "system_prompt", "example_messages"]
 
+# sqlite caches compiled statements by their exact text, so each query is written once here
+# and reused every time it is run.
+GET_IMAGE_DESCRIPTION_QUERY = """
+    SELECT description
+    FROM images i
+    WHERE i.url = ?
+"""
+# replaces the description if the image already has one
+ADD_IMAGE_DESCRIPTION_QUERY = """
+    INSERT INTO images (url, description)
+    VALUES (?, ?)
+    ON CONFLICT(url) DO UPDATE SET description = excluded.description
+"""
+
 
 class ImageDatabase:
     """
     A wrapper for the image database. 
 
     Attributes:
-        _conn (sqlite3.Connection): The SQLite database connection.
+        _conn (sqlite3.Connection): The SQLite database connection. It is only opened once
+            the database is first used.
         _cursor (sqlite3.Cursor): The cursor for executing SQL commands.
     """
 
@@ -28,18 +42,27 @@ class ImageDatabase:
                 from test_characters.db rather than characers.db.
         """
         if use_test:
-            db_file = "test_images.db"
+            self._db_file = "test_images.db"
         else:
-            db_file = "images.db"
+            self._db_file = "images.db"
 
+    @cached_property
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Opens the database the first time it is used, rather than whenever an ImageDatabase is made.
+        Most instances are made by models which may never see an image.
+        """
         # Connect to a database (or create it if it doesn't exist)
-        self._conn = sqlite3.connect(db_file)
-        self._conn.row_factory = sqlite3.Row  # return rows as dicts
-        self._conn.execute("PRAGMA foreign_keys = 1")  # enforce foreign keys
-        self._cursor = self._conn.cursor()
+        conn = sqlite3.connect(self._db_file)
+        conn.row_factory = sqlite3.Row  # return rows as dicts
+        conn.execute("PRAGMA foreign_keys = 1")  # enforce foreign keys
+        # write-ahead logging only syncs to disk at checkpoints rather than on every commit
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
 
         # Create the tables if they don't exist
-        self._cursor.execute(
+        conn.execute(
             """
             CREATE TABLE IF NOT EXISTS images (
                 url TEXT NOT NULL PRIMARY KEY,
@@ -47,6 +70,11 @@ class ImageDatabase:
             );
             """
         )
+        return conn
+
+    @cached_property
+    def _cursor(self) -> sqlite3.Cursor:
+        return self._conn.cursor()
 
     def get_image_description(
         self,
@@ -58,32 +86,40 @@ class ImageDatabase:
 
         If the image doesn't exist, returns None.
         """
-        query = """
-            SELECT description
-            FROM images i
-            WHERE i.url = ? 
-        """
-        self._cursor.execute(query, (url,))
-        rows = self._cursor.fetchall()
-        return rows[0]['description'] if rows else None
+        self._cursor.execute(GET_IMAGE_DESCRIPTION_QUERY, (url,))
+        row = self._cursor.fetchone()
+        return row['description'] if row else None
 
-    def add_image_description(self, url: str, description: int):
+    def add_image_description(self, url: str, description: str):
         """
         Adds an image and its description to the database.
+        If the image already has a description, it is replaced.
         """
+        self.add_image_descriptions([(url, description)])
 
-        query = """
-            INSERT INTO images (url, description)
-            VALUES (?, ?)
-            """
+    def add_image_descriptions(self, descriptions: list[tuple[str, str]]):
+        """
+        Adds several images and their descriptions to the database in a single transaction.
+        If an image already has a description, it is replaced.
 
-        # add a new character.
-        self._cursor.execute(query, (url, description))
+        Args:
+            descriptions (list of tuple of str, str): The (url, description) of each image
+        """
+        self._cursor.executemany(ADD_IMAGE_DESCRIPTION_QUERY, descriptions)
         self._conn.commit()
 
-    def __del__(self):
+    def close(self):
         """
-        When the ImageDatabase is deleted, clean up DB objects
+        Closes the database. The write-ahead log is checkpointed into the database
+        first, so it doesn't grow from one run of the bot to the next.
+        Closing a database which was never opened or is already closed does nothing.
         """
-        if self._conn:
-            self._conn.close()
+        # don't open the database just to close it
+        if "_conn" not in self.__dict__:
+            return
+        if "_cursor" in self.__dict__:
+            self._cursor.close()
+            del self._cursor
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.close()
+        del self._conn
@@ -1,18 +1,20 @@
 
+import asyncio
+from collections import OrderedDict
+import hashlib
 import json
 import re
-from typing import override
+from typing import AsyncIterator, Optional, override
 import aiohttp
+import httpx
 import openai
-from openai.types.chat.chat_completion import ChatCompletion
 from openai.types.completion import Completion
 import requests
 
 from synthea.VisionModel import VisionModel
 from synthea.Config import Config
 from synthea.Model import Model
-
-from jinja2 import Template
+from synthea.SyntheaUtilities import compile_template
 
 import Tools
 from ToolUtilities import (
@@ -24,6 +26,13 @@ from ToolUtilities import (
 
 TOOL_CALL_PATTERN = re.compile(r'<tool_call>(.*?)<\/tool_call>', re.DOTALL)
 
+# how many completions to remember for prompts that are generated without sampling.
+# only used when temperature is 0 in config.yaml, since otherwise every completion differs
+RESPONSE_CACHE_SIZE: int = 512
+# how many connections to the inference server are kept open at once
+MAX_CONNECTIONS: int = 32
+
+
 class LanguageModel(Model):
     """
     Makes requests to an openAI-compatible API that only
@@ -35,8 +44,39 @@ class LanguageModel(Model):
         self.image_model: VisionModel = VisionModel()
         self.openai: openai.AsyncOpenAI = openai.AsyncOpenAI(
             api_key=self.config.api_key,
-            base_url=self.config.api_base_url
+            base_url=self.config.api_base_url,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+            ),
         )
+        # completions for prompts generated at temperature 0, keyed by a hash of the prompt.
+        # those completions are always the same, so retries don't need to generate them again.
+        self._response_cache: OrderedDict[bytes, str] = OrderedDict()
+        self._cache_hits: int = 0
+        self._cache_misses: int = 0
+        # shared by every request so connections to the server are reused.
+        # a session has to be created inside the event loop, so it is created when first needed.
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Gets the session used to make requests to the inference server, creating it if needed.
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=60)
+            )
+        return self._session
+
+    @override
+    async def close(self):
+        """
+        Closes the connections to the inference server.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        await self.openai.close()
+        await self.image_model.close()
 
     @override
     async def queue_for_generation(self, chat_history: list[dict[str, dict[str, str]]]) -> str:
@@ -45,58 +85,42 @@ class LanguageModel(Model):
         it will take up the prompt and generate a response.
         """
         # load config again in case system prompts change
-        config: Config = Config()
+        config: Config = Config.get()
 
         # strip out the content, since the server isn't set up for multimodal
-        # and combine it to a simple string 
-        for chat_message in chat_history:
-            text = ""
-            for content_part in chat_message["content"]:
-                if content_part["type"] == "text":
-                    text += content_part["text"]
-                if content_part["type"] == "image_url":
-                    caption: str = await self.image_model.get_caption_for_image(content_part["image_url"]["url"])
-                    text += f"\n\n```SYSTEM: An image was attached to this message. Here is a description of the image: {caption}```"
-            chat_message["content"] = text
+        await self._flatten_chat_history(chat_history)
 
-        template = Template(config.chat_template)
+        template = compile_template(config.chat_template)
         prompt = template.render(messages=chat_history, add_generation_prompt=True)
-        inference_logger.info(prompt)
+        inference_logger.debug("Prompt:\n%s", prompt)
         generation_count = 0
         needs_call = True
         last_completion: str = ""
         while needs_call and generation_count < 5:
-            prompt = template.render(messages=chat_history, add_generation_prompt=True)
-
             # generate the response
             base_url = 'http://localhost:8080'
             # params = {'param1': 'value1', 'param2': 'value2'}
             
-            # Define the request body
-            body = {
-                'prompt': prompt,
-                'stop': config.stop_words,
-                'cache_prompt': True,
-                'n_predict': config.max_new_tokens
-            }
-
-            # Create an aiohttp session
-            async with aiohttp.ClientSession() as session:
-                # Make the POST request
-                async with session.post(config.api_base_url, json=body) as response:
-                    # Check if the request was successful
-                    if response.status == 200:
-                        # Parse the JSON response
-                        data = await response.json()
-                        print("Response data:", data)
-                    else:
-                        print(f"Error: HTTP {response.status}")
-                        print(await response.text())
-                        raise requests.exceptions.HTTPError(f"{response.status} Response from inference server: {response.text()}")
+            # a cached completion can't contain a tool call, so it is always the final one
+            cached_completion: Optional[str] = self._get_cached_response(prompt, config)
+            if cached_completion is not None:
+                return cached_completion
+
+            # Make the POST request
+            body = self._build_completion_body(prompt, config)
+            async with self._get_session().post(config.api_base_url, json=body) as response:
+                # Check if the request was successful
+                if response.status == 200:
+                    # Parse the JSON response
+                    data = await response.json()
+                    inference_logger.debug("Response data: %s", data)
+                else:
+                    inference_logger.error("Error: HTTP %d\n%s", response.status, await response.text())
+                    raise requests.exceptions.HTTPError(f"{response.status} Response from inference server: {response.text()}")
             generation_count += 1
             # TODO: Create a type for this
             last_completion = data["content"]
-            inference_logger.info(f"Completion:\n{last_completion}")
+            inference_logger.debug("Completion:\n%s", last_completion)
             
             # check for tool call in the response
             if config.use_tools and "<tool_call>" in last_completion:
@@ -110,12 +134,12 @@ class LanguageModel(Model):
                 tool_call_message["role"] = "assistant"
                 chat_history.append(tool_call_message)
 
-                # capture the JSON 
-                matches: str = TOOL_CALL_PATTERN.findall(last_completion)
+                # capture the JSON. only the first call is run, so stop scanning once it's found
+                match: re.Match | None = TOOL_CALL_PATTERN.search(last_completion)
                 tool_response_text = ""
-                if matches:
+                if match:
                     try:
-                        tool_call = json.loads(matches[0])
+                        tool_call = json.loads(match.group(1))
                         function_response = await self.execute_function_call(tool_call["name"], tool_call["arguments"])
                         tool_response_text += f"<tool_response>\n{function_response}\n</tool_response>\n"
                         inference_logger.info(f"Here's the response from the function call: {tool_call.get('name')}\n{function_response}")
@@ -131,43 +155,166 @@ class LanguageModel(Model):
                 tool_response_message["role"] = "tool"         
                 chat_history.append(tool_response_message)
                 inference_logger.info(f"Responded to model:\n {tool_response_message}")
+                # the prompt only changes once the tool call and its response are in the history
+                prompt = template.render(messages=chat_history, add_generation_prompt=True)
             else:
                 # no tool call, so we can just quit out
                 needs_call = False
+                self._cache_response(prompt, last_completion, config)
 
         # return the final result
         return last_completion
 
+    @override
+    async def stream_generation(self, chat_history: list[dict[str, dict[str, str]]]) -> AsyncIterator[str]:
+        """
+        Sends a prompt to the server for generation, yielding the text as the server generates it.
+        """
+        config: Config = Config.get()
+
+        # tool calls have to be read from the whole completion before anything is shown
+        if config.use_tools:
+            yield await self.queue_for_generation(chat_history)
+            return
+
+        await self._flatten_chat_history(chat_history)
+        template = compile_template(config.chat_template)
+        prompt = template.render(messages=chat_history, add_generation_prompt=True)
+        inference_logger.debug("Prompt:\n%s", prompt)
+
+        cached_completion: Optional[str] = self._get_cached_response(prompt, config)
+        if cached_completion is not None:
+            yield cached_completion
+            return
+
+        body = self._build_completion_body(prompt, config)
+        body['stream'] = True
+        completion_parts: list[str] = []
+        async with self._get_session().post(config.api_base_url, json=body) as response:
+            if response.status != 200:
+                inference_logger.error("Error: HTTP %d", response.status)
+                raise requests.exceptions.HTTPError(f"{response.status} Response from inference server: {await response.text()}")
+
+            # the server sends each new piece of the completion as a server-sent event
+            async for line in response.content:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data: "):
+                    continue
+                data = json.loads(line[len("data: "):])
+                completion_parts.append(data["content"])
+                yield data["content"]
+                if data.get("stop"):
+                    break
+
+        self._cache_response(prompt, "".join(completion_parts), config)
+
+    def _build_completion_body(self, prompt: str, config: Config) -> dict:
+        """
+        Builds the body of a request to the server's completion endpoint.
+        """
+        return {
+            'prompt': prompt,
+            'stop': config.stop_words,
+            'cache_prompt': True,
+            'n_predict': config.max_new_tokens,
+            # the server samples at its own default temperature unless told otherwise.
+            # sending it also makes sure completions cached at temperature 0 really were generated that way.
+            'temperature': config.temperature,
+        }
+
+    def _response_cache_key(self, prompt: str, config: Config) -> bytes:
+        """
+        Hashes a prompt along with everything else sent to the server which changes the completion,
+        so that a completion is only reused for a request that would generate the same thing.
+        """
+        request: str = json.dumps(
+            [prompt, config.api_base_url, config.stop_words, config.max_new_tokens, config.temperature]
+        )
+        return hashlib.blake2b(request.encode("utf-8"), digest_size=16).digest()
+
+    def _get_cached_response(self, prompt: str, config: Config) -> Optional[str]:
+        """
+        Returns the completion that was generated for this prompt before, if the prompt
+        is generated without sampling and the completion is still cached.
+        """
+        if config.temperature != 0:
+            return None
+        key: bytes = self._response_cache_key(prompt, config)
+        completion: Optional[str] = self._response_cache.get(key)
+        if completion is None:
+            self._cache_misses += 1
+            return None
+        self._response_cache.move_to_end(key)
+        self._cache_hits += 1
+        inference_logger.debug(
+            "Using cached completion (%d hits, %d misses)", self._cache_hits, self._cache_misses
+        )
+        return completion
+
+    def _cache_response(self, prompt: str, completion: str, config: Config):
+        """
+        Remembers the completion for a prompt, if the prompt was generated without sampling.
+        """
+        if config.temperature != 0 or not completion:
+            return
+        key: bytes = self._response_cache_key(prompt, config)
+        self._response_cache[key] = completion
+        self._response_cache.move_to_end(key)
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+
+    async def _flatten_chat_history(self, chat_history: list[dict[str, dict[str, str]]]):
+        """
+        Combines the content of each message in the chat history into a single string.
+        Images are replaced with a caption of the image.
+        """
+        # caption every image in the history at once, rather than waiting for each in turn.
+        # the same image may appear more than once, but only needs to be captioned once.
+        image_urls: list[str] = list(dict.fromkeys(
+            content_part["image_url"]["url"]
+            for chat_message in chat_history
+            for content_part in chat_message["content"]
+            if content_part["type"] == "image_url"
+        ))
+        captions: dict[str, str] = dict(zip(
+            image_urls,
+            await asyncio.gather(*(self.image_model.get_caption_for_image(url) for url in image_urls))
+        ))
+
+        for chat_message in chat_history:
+            text_parts: list[str] = []
+            for content_part in chat_message["content"]:
+                if content_part["type"] == "text":
+                    text_parts.append(content_part["text"])
+                if content_part["type"] == "image_url":
+                    caption: str = captions[content_part["image_url"]["url"]]
+                    text_parts.append(f"\n\n```SYSTEM: An image was attached to this message. Here is a description of the image: {caption}```")
+            chat_message["content"] = "".join(text_parts)
+
     async def execute_function_call(self, function_name: str, function_args: dict[str]):
         function_to_call = getattr(Tools, function_name, None)
         inference_logger.info(f"Invoking function call {function_name} ...")
-        function_response = await function_to_call(*function_args.values())
-        results_dict = f'{{"name": "{function_name}", "content": {function_response}}}'
-        return results_dict
+        # the arguments are passed by name, since the model may not give them in order
+        function_response = await function_to_call(**function_args)
+        # anything the encoder can't handle is written as a string rather than failing the call
+        return json.dumps(
+            {"name": function_name, "content": function_response},
+            ensure_ascii=False, default=str
+        )
 
-    @override
-    async def queue_for_chat_generation(self, chat_history: list[dict[str, dict[str, str]]]) -> str:
+    async def queue_for_chat_generation(self, chat_history: list[dict[str, dict[str, str]]]) -> AsyncIterator[str]:
         """
-        Sends a prompt to the server for generation. When the server is available,
-        it will take up the prompt and generate a response.
+        Sends a chat history to the server's chat completion endpoint, yielding the text
+        as the server generates it rather than waiting for the whole response.
         """
         # load config again in case system prompts change
-        config: Config = Config()
+        config: Config = Config.get()
 
         # strip out the content, since the server isn't set up for multimodal
-        # and combine it to a simple string 
-        for chat_message in chat_history:
-            text = ""
-            for content_part in chat_message["content"]:
-                if content_part["type"] == "text":
-                    text += content_part["text"]
-                if content_part["type"] == "image_url":
-                    caption: str = await self.image_model.get_caption_for_image(content_part["image_url"]["url"])
-                    text += f"\n\n```SYSTEM: An image was attached to this message. Here is a description of the image: {caption}```"
-            chat_message["content"] = text
+        await self._flatten_chat_history(chat_history)
 
-        print(chat_history)
-        chat_completion: ChatCompletion = await self.openai.chat.completions.create(
+        inference_logger.debug("Chat history: %s", chat_history)
+        stream = await self.openai.chat.completions.create(
             messages=chat_history,
             model="gpt-3.5-turbo",
             max_tokens=config.max_new_tokens,
@@ -176,8 +323,10 @@ class LanguageModel(Model):
             temperature=config.temperature,
             seed=-1,
             top_p=config.top_p,
-            stop=config.stop_words
+            stop=config.stop_words,
+            stream=True,
         )
         # TODO: Add error handling
-
-        return chat_completion.choices[0].message.content
\ No newline at end of file
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -0,0 +1,83 @@
+"""
+A small cache for messages fetched from discord.
+"""
+from collections import OrderedDict
+import time
+from typing import Optional
+import discord
+
+
+class MessageCache:
+    """
+    Caches messages fetched from discord, so that looking at the same replied message
+    or reply chain more than once doesn't make another request to discord each time.
+
+    Messages expire after a while, and can be dropped early when they are edited or deleted.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        """
+        Args:
+            max_size (int): The most messages to keep. The least recently used message
+                is dropped first.
+            ttl (float): How many seconds a message is kept before it is fetched again.
+        """
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self._messages: OrderedDict[tuple[int, int], tuple[float, discord.Message]] = OrderedDict()
+
+    async def fetch_message(self, channel: discord.abc.Messageable, message_id: int) -> discord.Message:
+        """
+        Fetches a message from a channel, using the cached copy if there is one.
+
+        Args:
+            channel (discord.abc.Messageable): The channel the message was sent in.
+            message_id (int): The id of the message to fetch.
+        Raises:
+            The same errors as channel.fetch_message
+        """
+        key = (channel.id, message_id)
+        cached = self._messages.get(key)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            self._messages.move_to_end(key)
+            return cached[1]
+
+        message: discord.Message = await channel.fetch_message(message_id)
+        self._messages[key] = (time.monotonic(), message)
+        self._messages.move_to_end(key)
+        if len(self._messages) > self.max_size:
+            self._messages.popitem(last=False)
+        return message
+
+    async def fetch_replied_message(self, message: discord.Message) -> Optional[discord.Message]:
+        """
+        Gets the message that a message replied to, only asking discord for it when it isn't
+        already at hand. The replied message is looked for in this order:
+
+        1. discord.py's own message cache, which is kept up to date when messages are edited.
+        2. The copy discord sent along with the reply. This is how the message looked when
+           the reply was sent, so it is only used when discord.py no longer has the message.
+        3. This cache, and then discord itself.
+
+        Args:
+            message (discord.Message): A message which replied to another message.
+        Returns:
+            The replied message, or None if discord says it was deleted.
+        Raises:
+            The same errors as channel.fetch_message
+        """
+        reference: discord.MessageReference = message.reference
+        if reference.cached_message:
+            return reference.cached_message
+        if isinstance(reference.resolved, discord.Message):
+            return reference.resolved
+        if isinstance(reference.resolved, discord.DeletedReferencedMessage):
+            return None
+        return await self.fetch_message(message.channel, reference.message_id)
+
+    def discard(self, channel_id: int, message_id: int):
+        """
+        Drops a message from the cache, if it is there. Use this when a message
+        is edited or deleted.
+        """
+        self._messages.pop((channel_id, message_id), None)
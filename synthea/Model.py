@@ -1,8 +1,20 @@
-
 from abc import abstractmethod
+from typing import AsyncIterator
 
 
 class Model:
     @abstractmethod
     async def queue_for_generation(self, chat_history: list[dict[str, dict[str, str]]]) -> str:
-        pass
\ No newline at end of file
+        pass
+
+    async def stream_generation(self, chat_history: list[dict[str, dict[str, str]]]) -> AsyncIterator[str]:
+        """
+        Generates a response, yielding pieces of the text as they are generated.
+        Models which can't stream yield the whole response at once.
+        """
+        yield await self.queue_for_generation(chat_history)
+
+    async def close(self):
+        """
+        Closes any connections the model holds open. Models which don't keep connections open do nothing.
+        """
\ No newline at end of file
@@ -5,9 +5,9 @@ The starting point for the program
 import multiprocessing
 import discord
 from discord import app_commands
-import yaml
 import asyncio
 
+from synthea.Config import load_yaml_cached
 from synthea.SyntheaClient import SyntheaClient
 from synthea.dtos.ResponseUpdate import ResponseUpdate
 from synthea.modals.CharCreationView import CharCreationView
@@ -32,8 +32,7 @@ def format_list(char_list: list[dict[str, str]]) -> str:
 
 
 if __name__ == "__main__":
-    with open("config.yaml", "r", encoding="utf-8") as file:
-        token = yaml.safe_load(file)["client_token"]
+    token = load_yaml_cached("config.yaml")["client_token"]
 
     # set up the discord client. The client and takes actions on our behalf
     intents = discord.Intents.all()
@@ -53,13 +52,10 @@ if __name__ == "__main__":
     )
     async def create_character_ui(interaction: discord.Interaction):
         """Opens the create_character UI for the user."""
-        with open(
-            "synthea/menu_dialogs/create_character.yaml", "r", encoding="utf-8"
-        ) as dialog_file:
-            dialogs = yaml.safe_load(dialog_file)
+        dialogs = load_yaml_cached("synthea/menu_dialogs/create_character.yaml")
         await interaction.response.send_message(
             dialogs[CharCreationStep.ID.value]["text"],
-            view=CharCreationView(),
+            view=CharCreationView(client.char_db),
             ephemeral=True,
         )
 
@@ -1,26 +1,30 @@
 """
 The discord client which contains the bulk of the logic for the chatbot.
 """
-from datetime import time
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import math
 import multiprocessing
+import os
+import queue
 import random
 import re
+import time
 import traceback
-from typing import Optional
+from typing import AsyncIterator, Optional
 import discord
 from discord import app_commands
 import openai
-import yaml
 import asyncio
+import functools
 from synthea import SyntheaUtilities
 
 from synthea.CharactersDatabase import CharactersDatabase
 
 from synthea.CommandParser import ChatbotParser, ParsedArgs
-from synthea.Config import Config
+from synthea.Config import Config, load_yaml_cached
 from synthea.ContextManager import ContextManager
+from synthea.MessageCache import MessageCache
 from synthea.VisionModel import VisionModel
 from synthea.LanguageModel import LanguageModel
 from synthea.Model import Model
@@ -33,9 +37,32 @@ from synthea.character_errors import (
 
 CHAR_LIMIT: int = 2000  # discord's character limit
 DISCORD_EMBED_LIMIT: int = 4000  # discord's character limit
-FOOTER_PATTERN: str = r"^(.*) \| (\d+)$"
-CHAT_TAG_PATTERN: str = r'^[^:\n]{2,32}:\s(.*)$'
+CHAT_TAG_PATTERN: re.Pattern = re.compile(r'^[^:\n]{2,32}:\s(.*)$', flags=re.DOTALL)
 SYSTEM_TAG = "System"
+# how much the bot logs. Prompts and responses are only logged at DEBUG.
+LOG_LEVEL: str = os.environ.get("SYNTHEA_LOG_LEVEL", "INFO").upper()
+# discord only allows 5 edits every 5 seconds, so streamed responses are updated at most this often
+STREAM_EDIT_INTERVAL: float = 1.0
+STREAM_PLACEHOLDER: str = "..."
+# introduces a character's example messages in its system prompt
+CHARACTER_EXAMPLES_HEADER: str = "\n\n Here are some examples of how to speak:\n"
+
+
+def measure_time(func):
+    """
+    Logs how long each call to one of the client's coroutines takes.
+    """
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            self.client_logger.info(
+                "Function %s took %.4f seconds to execute.", func.__name__, time.perf_counter() - start_time
+            )
+    return wrapper
+
 
 # This example requires the 'message_content' intent.
 class SyntheaClient(discord.Client):
@@ -64,50 +91,83 @@ class SyntheaClient(discord.Client):
     message_id_to_response_index: dict[int, int] = {}
 
     def __init__(self, intents):
-        super().__init__(intents=intents)
+        # the bot never needs the member lists of the guilds it is in, so don't request or
+        # cache them. Members are read from the messages they send instead.
+        super().__init__(
+            intents=intents,
+            chunk_guilds_at_startup=False,
+            member_cache_flags=discord.MemberCacheFlags.none(),
+        )
 
         self.language_model: LanguageModel = LanguageModel()
         self.image_model: VisionModel = VisionModel()
         self.config: Config = Config()
         self.char_db = CharactersDatabase()
+        self.parser: ChatbotParser = ChatbotParser()
+        self.message_cache: MessageCache = MessageCache()
+        # prefixes the model sometimes starts its responses with, lowercased so they can be removed regardless of case
+        self._response_prefixes: tuple[str, ...] = (
+            f"Message from {self.config.bot_name}".lower(),
+            "Message from Syn".lower(),
+        )
+        # generated text should never ping anyone. Only the reply itself pings the user
+        # who invoked the bot; the messages continuing it ping no one.
+        self.allowed_mentions_reply: discord.AllowedMentions = discord.AllowedMentions(
+            everyone=False, users=False, roles=False, replied_user=True
+        )
+        self.allowed_mentions_none: discord.AllowedMentions = discord.AllowedMentions.none()
+        # needs the bot's user id, so it is created once the bot has logged in
+        self.context_manager: ContextManager = None
 
         self.client_logger = logging.getLogger("synthea-client-logger")
+        self.client_logger.setLevel(LOG_LEVEL)
+        # the queue handler below already writes to the console
+        self.client_logger.propagate = False
+        # the loggers of the other modules, and the inference logger used by the language model
+        logging.getLogger("synthea").setLevel(LOG_LEVEL)
+        logging.getLogger("function-calling-inference").setLevel(LOG_LEVEL)
         console_handler = logging.StreamHandler()
         formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         console_handler.setFormatter(formatter)
-        self.client_logger.addHandler(console_handler)
-
-
-    # async def setup_hook(self):
-    #     """
-    #     When the bot is started and logs in, load the model.
-    #     """
-   
-    def measure_time(self, func):
-        def wrapper(*args, **kwargs):
-            start_time = time.time()
-            result = func(*args, **kwargs)
-            end_time = time.time()
-            execution_time = end_time - start_time
-            self.client_logger.info(f"Function {func.__name__} took {execution_time:.4f} seconds to execute.")
-            return result
-        return wrapper
+        # write to the console from another thread so logging never blocks the event loop
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.client_logger.addHandler(QueueHandler(log_queue))
+        self.log_listener: QueueListener = QueueListener(log_queue, console_handler)
+        self.log_listener.start()
+
+
+    async def setup_hook(self):
+        """
+        When the bot logs in, set up anything which needs to know the bot's user.
+        """
+        self.context_manager = ContextManager(
+            self.user.id, self.char_db, parser=self.parser, message_cache=self.message_cache
+        )
+
+    async def close(self):
+        """
+        Stops the bot, then cleans up anything the bot was holding on to.
+        """
+        await super().close()
+        await self.language_model.close()
+        await self.image_model.close()
+        self.char_db.close()
+        self.log_listener.stop()
 
     async def on_ready(self):
         """
         Reports to the console that we logged in.
         """
-        with open("config.yaml", encoding="utf-8") as config_file:
-            config = yaml.safe_load(config_file)
-            await self.change_presence(activity=discord.Game(name=config["activity"]))
+        config = load_yaml_cached("config.yaml")
+        await self.change_presence(activity=discord.Game(name=config["activity"]))
 
         # sync slash commands only the first time that we are ready
         if not self.synced:
             await self.tree.sync()
             self.synced = True
-            print("Synced command tree")
+            self.client_logger.info("Synced command tree")
 
-        print(f"Logged on as {self.user}!")
+        self.client_logger.info("Logged on as %s!", self.user)
 
     async def on_reaction_add(self, reaction: discord.Reaction, user):
         """
@@ -131,19 +191,42 @@ class SyntheaClient(discord.Client):
 
             # regenerate the response
             if reaction.emoji == "🔁":
-                user_message = await reaction.message.channel.fetch_message(reaction.message.reference.message_id)
-                
-                # TODO: regenerate the response.
-                await reaction.message.delete()
-                await user_message.remove_reaction("❌", self.user)
-                await user_message.remove_reaction("⚠️", self.user)
-                await user_message.remove_reaction("✅", self.user)
-                await user_message.add_reaction("⏳")
+                # the old response can be deleted while the user's message is fetched
+                user_message, _ = await asyncio.gather(
+                    self.message_cache.fetch_message(
+                        reaction.message.channel, reaction.message.reference.message_id
+                    ),
+                    reaction.message.delete(),
+                )
+                # swap the old result for the hourglass in the background, while the
+                # new response is prepared
+                status_reactions: asyncio.Future = asyncio.gather(
+                    user_message.remove_reaction("❌", self.user),
+                    user_message.remove_reaction("⚠️", self.user),
+                    user_message.remove_reaction("✅", self.user),
+                    user_message.add_reaction("⏳"),
+                    return_exceptions=True,
+                )
 
                 # create a new response
-                await self.respond_to_user(user_message)
+                replied_char_id = await self._get_character_replied_to(user_message)
+                await self.respond_to_user(user_message, replied_char_id=replied_char_id)
+                # the hourglass has to be on the message before it can be removed
+                await status_reactions
                 await user_message.remove_reaction("⏳", self.user)
 
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        """
+        Drops edited messages from the message cache so the new version is fetched.
+        """
+        self.message_cache.discard(payload.channel_id, payload.message_id)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """
+        Drops deleted messages from the message cache.
+        """
+        self.message_cache.discard(payload.channel_id, payload.message_id)
+
     async def on_message(self, message: discord.Message):
         """
         Respond to messages sent to the bot.
@@ -159,60 +242,90 @@ class SyntheaClient(discord.Client):
         if message.webhook_id:
             return
 
+        # don't fetch anything for messages the bot couldn't respond to anyway
+        if not self._can_send_in(message.channel):
+            return
+
         # by default, don't respond to messages unless it was directed at the bot
         message_invokes_chatbot: bool = False
-        if message.content.lower().startswith(self.config.command_start_str.lower()):
+        replied_message: Optional[discord.Message] = None
+        if self.parser.is_command(message.content):
             # if the message starts with the start string, then it was definitely directed at the bot.
             message_invokes_chatbot = True
-        elif message.reference:
+        elif message.reference and message.reference.message_id:
             # if the message replied to the bot, then it was directed at the bot.
             try:
-                replied_message: discord.Message = await message.channel.fetch_message(
-                    message.reference.message_id
-                )
-                if replied_message.author.id == self.user.id:
+                replied_message = await self.message_cache.fetch_replied_message(message)
+                if replied_message and replied_message.author.id == self.user.id:
                     message_invokes_chatbot = True
             except (discord.NotFound, discord.HTTPException, discord.Forbidden) as exc:
-                print(exc)
-            character_replied_to = await self._get_character_replied_to(message)
-            if character_replied_to:
-                # check if this webhook represents a character that the chatbot adopted
-                message_invokes_chatbot = True
+                self.client_logger.warning("Could not fetch the replied message: %s", exc)
 
         if not message_invokes_chatbot:
             return
 
         # the message was meant for the bot and we must respond
+        # the hourglass is added in the background so it doesn't hold up the response
+        hourglass: asyncio.Task = asyncio.create_task(message.add_reaction("⏳"))
         try:
+            # characters only speak through the bot, so this is only needed once we know to respond
+            character_replied_to: Optional[str] = await self._get_character_replied_to(
+                message, replied_message
+            )
             # await message.add_reaction("🛑")
-            await message.add_reaction("⏳")
-            await self.respond_to_user(message)
-            await message.add_reaction("✅")
+            await self.respond_to_user(message, replied_char_id=character_replied_to)
+            result_reaction = "✅"
 
         # if error, let the user know what went wrong
         # pylint: disable-next=broad-exception-caught
         except Exception as err:
-            await message.add_reaction("❌")
+            result_reaction = "❌"
             traceback.print_exc(limit=4)
             err_string = f"{err}"[:1024]
-            await message.reply(f"❌ {err_string}", mention_author=True)
+            await message.reply(
+                f"❌ {err_string}", mention_author=True, allowed_mentions=self.allowed_mentions_reply
+            )
 
-        await message.remove_reaction("⏳", self.user)
+        # the hourglass has to be on the message before it can be swapped for the result
+        await asyncio.gather(hourglass, return_exceptions=True)
+        await asyncio.gather(
+            message.add_reaction(result_reaction),
+            message.remove_reaction("⏳", self.user),
+        )
+
+    def _can_send_in(self, channel: discord.abc.Messageable) -> bool:
+        """
+        Checks if the bot is allowed to send messages in a channel. This only uses
+        cached data, so it is cheap enough to check for every message.
+        """
+        # the bot can always send messages in DMs
+        if not getattr(channel, "guild", None):
+            return True
+        permissions = channel.permissions_for(channel.guild.me)
+        if isinstance(channel, discord.Thread):
+            return permissions.send_messages_in_threads
+        return permissions.send_messages
 
     @measure_time
-    async def respond_to_user(self, message_from_user: discord.Message):
+    async def respond_to_user(
+        self,
+        message_from_user: discord.Message,
+        replied_char_id: Optional[str] = None,
+    ):
         """
         Generates and send a response to a user message from the chatbot
 
         Args:
             message (str): The message to respond to
+            replied_char_id (str, optional): The id of the character that message_from_user
+                replied to, if any. Use _get_character_replied_to to find it.
         """
-        config: Config = Config()
+        config: Config = Config.get()
 
         ### Deal with the case that the user made a command in this message
-        command: str = message_from_user.clean_content
-        parser: ChatbotParser = ChatbotParser()
-        args: ParsedArgs = parser.parse(command)
+        # the raw content is enough to read the flags, and skips resolving mentions
+        command: str = message_from_user.content
+        args: ParsedArgs = self.parser.parse(command)
 
         # if the user wants to use this as the system prompt going forward, just
         # give them a checkmark and wait for further prompts
@@ -221,8 +334,7 @@ class SyntheaClient(discord.Client):
             return
 
         # read the history to find the current applicable command
-        context_manager = ContextManager(self.user.id)
-        chat_history, args = await context_manager.generate_chat_history_from_chat(
+        chat_history, args = await self.context_manager.generate_chat_history_from_chat(
             message_from_user, system_prompt=config.system_prompt
         )
 
@@ -230,12 +342,11 @@ class SyntheaClient(discord.Client):
         model: Model = self.language_model
         if args:
             if args.use_image_model:
-                print("Using image model")
+                self.client_logger.debug("Using image model")
                 model = self.image_model
             char_id = args.character
 
         # if the user responded to the bot playing a character, respond as that character
-        replied_char_id = await self._get_character_replied_to(message_from_user)
         if replied_char_id:
             char_id = replied_char_id
 
@@ -252,48 +363,60 @@ class SyntheaClient(discord.Client):
 
             char_data = self.char_db.load_character(char_id)
 
-            system_prompt: str = ""
-            if "system_prompt" in char_data and char_data["system_prompt"]:
-                system_prompt += char_data["system_prompt"]
-            if "example_messages" in char_data and char_data["example_messages"]:
-                system_prompt += "\n\n Here are some examples of how to speak:\n"
-                system_prompt += char_data["example_messages"]
-
-            chat_history, _ = await context_manager.generate_chat_history_from_chat(
-                message_from_user, system_prompt=system_prompt
+            chat_history, _ = await self.context_manager.generate_chat_history_from_chat(
+                message_from_user, system_prompt=self._get_character_system_prompt(char_data)
             )
 
-        response = await model.queue_for_generation(chat_history)
-        response = self._preprocess_response(response)
+        response_stream: AsyncIterator[str] = model.stream_generation(chat_history)
 
         if char_id and char_id != SYSTEM_TAG:
-            print(f"Resp for {message_from_user.author} with char {char_id}")
-            print(response)
-            await self.send_response_as_character(response, char_data, message_from_user)
+            response = await self.send_response_as_character(response_stream, char_data, message_from_user)
         else:
-            print(f"Resp for {message_from_user.author}")
-            print(response)
-            await self.send_response_as_base(response, message_from_user)
+            response = await self.send_response_as_base(response_stream, message_from_user)
+        # %-style arguments so the response is only formatted when debug logging is on
+        self.client_logger.debug(
+            "Resp for %s with char %s:\n%s", message_from_user.author, char_id, response
+        )
+
+    def _get_character_system_prompt(self, char_data: dict[str, str]) -> str:
+        """
+        Builds the system prompt for a character from its system prompt and example messages.
+        """
+        prompt_parts: list[str] = []
+        if char_data.get("system_prompt"):
+            prompt_parts.append(char_data["system_prompt"])
+        if char_data.get("example_messages"):
+            prompt_parts.append(CHARACTER_EXAMPLES_HEADER)
+            prompt_parts.append(char_data["example_messages"])
+        return "".join(prompt_parts)
+
+    def _remove_prefix_ignoring_case(self, text: str, prefix: str) -> str:
+        """
+        Removes a prefix from some text if the text starts with it, ignoring case.
+        Only the start of the text is lowercased to compare it with the prefix.
+
+        Args:
+            text (str): The text to remove the prefix from
+            prefix (str): The prefix to remove. Must already be lowercase.
+        """
+        if text[:len(prefix)].lower() == prefix:
+            return text[len(prefix):]
+        return text
 
     def _preprocess_response(self, response: str) -> str:
         """
         Does some simple preprocessing to improve the quality of responses
         """
-        if response.lower().startswith(f"Message from {self.config.bot_name}".lower()):
-            response = response[len(f"Message from {self.config.bot_name}"):]
-        if response.lower().startswith(f"Message from Syn".lower()):
-            response = response[len(f"Message from Syn"):]
+        for prefix in self._response_prefixes:
+            response = self._remove_prefix_ignoring_case(response, prefix)
 
         # remove roleplay chat tags
         # This regex now uses a capture group to match the rest of the line
-        match = re.match(CHAT_TAG_PATTERN, response, flags=re.DOTALL)
+        match = CHAT_TAG_PATTERN.match(response)
         if match:
             # If there's a match, return the captured group (rest of the line)
             response = match.group(1)
-        if response.lower().startswith("Syn:".lower()):
-            response = response[len("Syn:"):]
-        if len(response) > DISCORD_EMBED_LIMIT:
-            response = response[:DISCORD_EMBED_LIMIT]
+        response = self._remove_prefix_ignoring_case(response, "syn:")
 
         # remove stop words at end
         for stop_word in self.config.stop_words:
@@ -301,16 +424,17 @@ class SyntheaClient(discord.Client):
                 response = response[:len(response)-len(stop_word)]
         return response
 
-    async def send_response_as_base(self, response: str, message: discord.Message):
+    async def send_response_as_base(self, response: AsyncIterator[str], message: discord.Message) -> str:
         """
-        Sends a simple response using the base template of the model.
+        Streams a simple response using the base template of the model.
+
+        Returns:
+            (str): The full response that was sent
         """
         # create an embed to extend the character count
-        embed: discord.Embed = discord.Embed(
-            description=response,
-        )
+        embed: discord.Embed = discord.Embed()
 
-        await self.send_response(response_text=response, embed=embed, message_to_reply=message)
+        return await self.stream_response(response_stream=response, embed=embed, message_to_reply=message)
 
     async def send_response_as_system(self, response: str, message: discord.Message):
         """
@@ -325,13 +449,15 @@ class SyntheaClient(discord.Client):
         await self.send_response(response_text=response, embed=embed, message_to_reply=message, add_buttons=False)
 
     async def send_response_as_character(
-        self, response: str, char_data: dict[str, str], message: discord.Message
-    ):
+        self, response: AsyncIterator[str], char_data: dict[str, str], message: discord.Message
+    ) -> str:
         """
-        Sends the given response in the same channel as the given message while
+        Streams the given response in the same channel as the given message while
         using the picture and name associated with the character.
 
-        response (str): The response to be sent
+        response (AsyncIterator[str]): The response to be sent, as it is generated
+        Returns:
+            (str): The full response that was sent
         """
         if not char_data:
             raise CharacterNotFoundError()
@@ -345,7 +471,6 @@ class SyntheaClient(discord.Client):
 
         embed: discord.Embed = discord.Embed(
             title=char_name,
-            description=response,
         )
 
         # add a picture via url
@@ -356,8 +481,8 @@ class SyntheaClient(discord.Client):
         embed.set_footer(text=char_data["id"])
 
         # send the message with embed
-        await self.send_response(
-            response_text=response,
+        return await self.stream_response(
+            response_stream=response,
             embed=embed,
             message_to_reply=message,
         )
@@ -383,8 +508,8 @@ class SyntheaClient(discord.Client):
                 If response_text is None, then embed is required.
             thread (discord.Thread or None): If provided, the response will be sent in this thread.
         """
-        # split up the response into messages and send them individually
-        # print(f"Response ({len(response_text)} chars):\n{response_text}")
+        if self.client_logger.isEnabledFor(logging.DEBUG):
+            self.client_logger.debug("Response (%d chars):\n%s", len(response_text or ""), response_text)
 
         if not embed and not response_text:
             # TODO: Decide if sending a default response or raising an error is better.
@@ -392,36 +517,147 @@ class SyntheaClient(discord.Client):
             response_text = "..."
             # raise ValueError("No embed or response text included in the response.")
 
-        bot_message: discord.Message = await message_to_reply.reply(mention_author=True, embed=embed)
+        if not embed:
+            embed = discord.Embed(description=response_text)
+
+        # embeds can only hold so much text, so long responses are split across several embeds
+        chunks: list[str] = SyntheaUtilities.split_text_smartly(response_text or "", DISCORD_EMBED_LIMIT)
+        if chunks:
+            embed.description = chunks[0]
+
+        bot_message: discord.Message = await message_to_reply.reply(
+            mention_author=True, embed=embed, allowed_mentions=self.allowed_mentions_reply
+        )
+
+        # only the first chunk replies to the user. The rest are sent straight to the channel,
+        # one at a time so that they arrive in order.
+        for chunk in chunks[1:]:
+            await message_to_reply.channel.send(
+                embed=self._continuation_embed(embed, chunk),
+                allowed_mentions=self.allowed_mentions_none,
+            )
 
         # add controls
         if add_buttons:
             await bot_message.add_reaction("🗑️")
             await bot_message.add_reaction("🔁")
 
-    async def _get_character_replied_to(self, message: discord.Message) -> str | None:
+    async def stream_response(
+        self,
+        response_stream: AsyncIterator[str],
+        embed: discord.Embed,
+        message_to_reply: discord.Message,
+    ) -> str:
+        """
+        Sends a response while it is still being generated. A placeholder reply is sent
+        right away and edited as the text arrives, spilling over into new messages if the
+        response gets too long for one embed.
+
+        Args:
+            response_stream (AsyncIterator[str]): The pieces of the response as they are generated.
+            embed (discord.Embed): The embed to show the response in. Its description is
+                replaced with the response.
+            message_to_reply (discord.Message): The message that the user sent to invoke the bot.
+        Returns:
+            (str): The full response, after preprocessing
+        """
+        channel = message_to_reply.channel
+        embed.description = STREAM_PLACEHOLDER
+        sent_messages: list[discord.Message] = [
+            await message_to_reply.reply(
+                mention_author=True, embed=embed, allowed_mentions=self.allowed_mentions_reply
+            )
+        ]
+        shown_chunks: list[str] = [STREAM_PLACEHOLDER]
+
+        async def show(response_text: str):
+            """Edits only the messages whose text changed, and sends any new ones needed"""
+            chunks = SyntheaUtilities.split_text_smartly(response_text, DISCORD_EMBED_LIMIT) or [STREAM_PLACEHOLDER]
+            for index, chunk in enumerate(chunks):
+                if index >= len(sent_messages):
+                    sent_messages.append(await channel.send(
+                        embed=self._continuation_embed(embed, chunk),
+                        allowed_mentions=self.allowed_mentions_none,
+                    ))
+                    shown_chunks.append(chunk)
+                elif shown_chunks[index] != chunk:
+                    if index == 0:
+                        embed.description = chunk
+                        await sent_messages[0].edit(embed=embed)
+                    else:
+                        await sent_messages[index].edit(embed=self._continuation_embed(embed, chunk))
+                    shown_chunks[index] = chunk
+
+            # preprocessing can shorten the response, leaving messages with nothing to show
+            for extra_message in sent_messages[len(chunks):]:
+                await extra_message.delete()
+            del sent_messages[len(chunks):]
+            del shown_chunks[len(chunks):]
+
+        response_parts: list[str] = []
+        last_update: float = time.monotonic()
+        try:
+            async for text in response_stream:
+                response_parts.append(text)
+                if time.monotonic() - last_update >= STREAM_EDIT_INTERVAL:
+                    await show(self._preprocess_response("".join(response_parts)))
+                    last_update = time.monotonic()
+
+            response: str = self._preprocess_response("".join(response_parts))
+            await show(response)
+        except BaseException:
+            # a half-sent response carries the character's footer, so if it were left in the
+            # channel it would be read back later as something the character said
+            await asyncio.gather(
+                *(sent_message.delete() for sent_message in sent_messages), return_exceptions=True
+            )
+            raise
+
+        # add controls
+        await sent_messages[0].add_reaction("🗑️")
+        await sent_messages[0].add_reaction("🔁")
+        return response
+
+    def _continuation_embed(self, embed: discord.Embed, text: str) -> discord.Embed:
+        """
+        Creates an embed which continues a response that was too long for a single embed.
+        The footer is kept so the continuation is read the same way as the first embed
+        when building the chat history.
+        """
+        continuation: discord.Embed = discord.Embed(description=text)
+        if embed.footer.text:
+            continuation.set_footer(text=embed.footer.text)
+        return continuation
+
+    async def _get_character_replied_to(
+        self,
+        message: discord.Message,
+        replied_message: Optional[discord.Message] = None,
+    ) -> str | None:
         """
         Determines if a user replied to a character.
 
         Args:
             message (discord.Message): The message the user sent.
+            replied_message (discord.Message, optional): The message the user replied to.
+                If it was already fetched, pass it in so it isn't fetched again.
         Returns:
             (str, optional): The id of the character who sent the message the user replied to.
                 If there is no character or this message is not a reply, returns None instead
         """
         # if the bot was invoked without replying to a message, no character was replied to.
-        if not message.reference:
+        if not message.reference or not message.reference.message_id:
             return None
 
         try:
             # bot uses embeds to speak as a character
-            replied_message: discord.Message = await message.channel.fetch_message(
-                message.reference.message_id
-            )
+            if not replied_message:
+                replied_message = await self.message_cache.fetch_replied_message(message)
 
             # if no embed, it wasn't speaking as a character
             if (
-                not replied_message.embeds
+                not replied_message
+                or not replied_message.embeds
                 or not replied_message.author.id == self.user.id
             ):
                 return None
@@ -432,6 +668,6 @@ class SyntheaClient(discord.Client):
 
         # if we can't retrieve the replied message (maybe deleted), just say no char
         except (discord.NotFound, discord.HTTPException, discord.Forbidden) as exc:
-            print(exc)
+            self.client_logger.warning("Could not fetch the replied message: %s", exc)
 
         return None
@@ -1,12 +1,26 @@
+from functools import lru_cache
+
+
 def split_text(text, max_length=1800) -> list[str]:
     return [text[i:i+max_length] for i in range(0, len(text), max_length)]
 
 
+@lru_cache(maxsize=8)
+def compile_template(chat_template: str):
+    """
+    Compiles a jinja chat template, reusing the compiled template if the same one was compiled before.
+    """
+    # imported here so the text helpers in this module can be used without jinja installed
+    from jinja2 import Template
+    return Template(chat_template)
+
+
 def split_text_smartly(text, max_length=2000) -> list[str]:
     """
     Split the text into pieces of at most max_length characters. 
     The function prioritizes splitting at paragraph breaks, then periods, and finally spaces.
-    It tries to keep the pieces about equally sized.
+    If a piece ends inside a code block, the code block is closed at the end of the piece
+    and opened again at the start of the next one, so it renders the same in both.
     
     Args:
     - text (str): The input text.
@@ -15,7 +29,47 @@ def split_text_smartly(text, max_length=2000) -> list[str]:
     Returns:
     - List[str]: List of text pieces.
     """
-    
+    pieces = _split_at_breaks(text, max_length)
+
+    # close code blocks left open at the end of a piece, and reopen them in the next one
+    open_fence = ""
+    index = 0
+    while index < len(pieces):
+        piece = pieces[index]
+        reopened_fence = open_fence
+        closing_fence = reopened_fence
+        for line in piece.split("\n"):
+            stripped_line = line.lstrip()
+            if stripped_line.startswith("```"):
+                closing_fence = "" if closing_fence else stripped_line
+
+        # room is only made for the fences when a piece is actually inside a code block
+        reopen_length = len(reopened_fence) + 1 if reopened_fence else 0
+        if reopen_length + len(piece) + (len("\n```") if closing_fence else 0) > max_length:
+            room = max_length - reopen_length - len("\n```")
+            if len(piece) > room > 0:
+                pieces[index:index + 1] = _split_at_breaks(piece, room)
+                continue
+
+        if reopened_fence:
+            piece = reopened_fence + "\n" + piece
+        if closing_fence:
+            piece += "\n```"
+        # the language tag is all that can be dropped if the fence takes up too much of a piece
+        if len(closing_fence) > max_length // 2:
+            closing_fence = "```"
+        open_fence = closing_fence
+        pieces[index] = piece
+        index += 1
+
+    return pieces
+
+
+def _split_at_breaks(text, max_length) -> list[str]:
+    """
+    Splits the text into pieces of at most max_length characters, at paragraph breaks
+    where possible, then periods, and finally spaces.
+    """
     # Split by paragraph first
     paragraphs = text.split('\n')
     pieces = []
@@ -23,7 +77,7 @@ def split_text_smartly(text, max_length=2000) -> list[str]:
 
     for paragraph in paragraphs:
         # If the current piece + the new paragraph is too long
-        if len(current_piece + paragraph) > max_length:
+        if len(current_piece) + len(paragraph) + 1 > max_length:
             # If the current piece is not empty, add it to the pieces
             if current_piece:
                 pieces.append(current_piece)
@@ -40,10 +94,12 @@ def split_text_smartly(text, max_length=2000) -> list[str]:
                 
                 # If there's neither a period nor a space, just split at max_length
                 if split_point == -1:
-                    split_point = max_length
+                    split_point = max_length - 1
                 
                 # Add the split part to the pieces and remove it from the paragraph
-                pieces.append(paragraph[:split_point + 1].strip())
+                piece = paragraph[:split_point + 1].strip()
+                if piece:
+                    pieces.append(piece)
                 paragraph = paragraph[split_point + 1:].strip()
             
             # Add the remainder of the paragraph to the current piece
@@ -60,4 +116,3 @@ def split_text_smartly(text, max_length=2000) -> list[str]:
         pieces.append(current_piece)
 
     return pieces
-    
\ No newline at end of file
@@ -22,7 +22,7 @@ log_file_path = os.path.join(
 )
 # Use RotatingFileHandler from the logging.handlers module
 file_handler = RotatingFileHandler(log_file_path, maxBytes=0, backupCount=0)
-file_handler.setLevel(logging.INFO)
+# no level of its own, so the file follows the inference logger's level (SYNTHEA_LOG_LEVEL)
 
 formatter = logging.Formatter("%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s", datefmt="%Y-%m-%d:%H:%M:%S")
 file_handler.setFormatter(formatter)
@@ -1,12 +1,20 @@
-from typing import override
+import asyncio
+import logging
+from typing import AsyncIterator, override
 import discord
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from openai.types.chat.chat_completion import ChatCompletion
 
 from synthea.ImageDatabase import ImageDatabase
 from synthea.Config import Config
 from synthea.Model import Model
 
+logger = logging.getLogger(__name__)
+
+# how many connections to the vision server are kept open at once
+MAX_CONNECTIONS: int = 16
+
 
 class VisionModel(Model):
     """
@@ -19,8 +27,15 @@ class VisionModel(Model):
         self.config: Config = Config()
         self.image_database: ImageDatabase = ImageDatabase()
         self.openai: AsyncOpenAI = AsyncOpenAI(
-            base_url=self.config.image_api_base_url, api_key=self.config.image_api_key
+            base_url=self.config.image_api_base_url,
+            api_key=self.config.image_api_key,
+            # images in a chat history are captioned at the same time, so keep enough connections open for them
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+            ),
         )
+        # captions which are being generated right now, keyed by image url
+        self._pending_captions: dict[str, asyncio.Task[str]] = {}
 
     @override
     async def queue_for_generation(self, chat_history: list[dict[str, dict[str, str]]]) -> str:
@@ -28,29 +43,76 @@ class VisionModel(Model):
         Sends a prompt to the server for generation. When the server is available,
         it will take up the prompt and generate a response.
         """
-        config: Config = Config()
+        config: Config = Config.get()
 
-        print(chat_history)
+        logger.debug("Chat history: %s", chat_history)
         chat_completion: ChatCompletion = await self.openai.chat.completions.create(
-            messages=chat_history,
-            model="gpt-4-vision-preview",
-            max_tokens=config.max_new_tokens,
-            presence_penalty=config.presence_penalty,
-            frequency_penalty=config.frequency_penalty,
-            temperature=config.temperature,
-            seed=-1,
-            top_p=config.top_p,
-            stop=config.stop_words
+            **self._completion_kwargs(chat_history, config)
         )
         # TODO: Add error handling
 
         return chat_completion.choices[0].message.content
 
-    async def get_caption_for_image(self, image_url: str):
+    @override
+    async def stream_generation(self, chat_history: list[dict[str, dict[str, str]]]) -> AsyncIterator[str]:
+        """
+        Sends a prompt to the server for generation, yielding the text as the server generates it.
+        """
+        config: Config = Config.get()
+
+        stream = await self.openai.chat.completions.create(
+            **self._completion_kwargs(chat_history, config), stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _completion_kwargs(self, chat_history: list[dict[str, dict[str, str]]], config: Config) -> dict:
+        """
+        Builds the arguments for a chat completion request to the vision server.
+        """
+        return {
+            "messages": chat_history,
+            "model": "gpt-4-vision-preview",
+            "max_tokens": config.max_new_tokens,
+            "presence_penalty": config.presence_penalty,
+            "frequency_penalty": config.frequency_penalty,
+            "temperature": config.temperature,
+            "seed": -1,
+            "top_p": config.top_p,
+            "stop": config.stop_words,
+        }
+
+    @override
+    async def close(self):
+        """
+        Closes the connections to the vision server and the image database.
+        """
+        await self.openai.close()
+        self.image_database.close()
+
+    async def get_caption_for_image(self, image_url: str) -> str:
+        """
+        Gets a description of an image. Each image is only captioned once. The caption is
+        stored in the image database, and requests for an image which is being captioned
+        right now wait for that caption rather than asking for another.
+        """
         description: str | None = self.image_database.get_image_description(image_url)
         if description:
             return description
 
+        pending: asyncio.Task[str] | None = self._pending_captions.get(image_url)
+        if pending is None:
+            pending = asyncio.create_task(self._caption_image(image_url))
+            self._pending_captions[image_url] = pending
+            pending.add_done_callback(lambda _: self._pending_captions.pop(image_url, None))
+        # shielded so that one caller being cancelled doesn't cancel the caption for everyone else
+        return await asyncio.shield(pending)
+
+    async def _caption_image(self, image_url: str) -> str:
+        """
+        Asks the vision model to describe an image, then stores the description.
+        """
         messages = [
             {
                 "role": "system",
@@ -1,11 +1,11 @@
 from synthea.modals.CharCreationStep import CharCreationStep
 from typing import Callable
-import yaml
 import discord
 from discord import TextStyle, ui
 from discord.enums import ButtonStyle
 from discord.interactions import Interaction
 from synthea.CharactersDatabase import CharactersDatabase
+from synthea.Config import load_yaml_cached
 from synthea.character_errors import (
     DuplicateCharacterError,
     InvalidCharacterIDError,
@@ -17,7 +17,12 @@ class CharCreationView(ui.View):
     for creating characters. This view is shown with the /create_character command.
     """
 
-    def __init__(self):
+    def __init__(self, char_db: CharactersDatabase):
+        """
+        Args:
+            char_db (CharactersDatabase): The database to create the character in.
+                Pass the client's database rather than opening another one.
+        """
         super().__init__(timeout=300)
 
         # the order of steps and the callback to run when each step's modal is submitted
@@ -58,16 +63,13 @@ class CharCreationView(ui.View):
         ]
 
         # used to update the character at each step
-        self.char_db = CharactersDatabase()
+        self.char_db: CharactersDatabase = char_db
 
         # caches the answers the user gives for each step
         self.data_dict = {}
 
         # retrieve data on modals and descriptions from yaml
-        with open(
-            "synthea/menu_dialogs/create_character.yaml", "r", encoding="utf-8"
-        ) as file:
-            self.dialogs = yaml.safe_load(file)
+        self.dialogs = load_yaml_cached("synthea/menu_dialogs/create_character.yaml")
 
         # Create navigation buttons
         self.previous_step_button = ui.Button(label="<", style=ButtonStyle.blurple)
@@ -16,8 +16,8 @@ class UpdateCharModal(ui.Modal):
     def __init__(self, char_id: str, interaction: Interaction):
         super().__init__(title=f"Update Character {char_id}")
 
-        # used to update the character at each step
-        self.char_db = CharactersDatabase()
+        # used to update the character at each step. shared with the client, so it isn't closed here
+        self.char_db: CharactersDatabase = interaction.client.char_db
         self.char_id = char_id
 
         # can raise CharacterNotFoundError if the character doesn't exist
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the bot is started with `python synthea/Synthea.py`, which puts the synthea directory on the path.
+# some modules import their neighbours by that path (`import Tools`), so tests which import them need it too.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
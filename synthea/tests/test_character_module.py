@@ -6,6 +6,7 @@ from synthea.character_errors import (
     CharacterNotFoundError,
     ForbiddenCharacterError,
     DuplicateCharacterError,
+    InvalidCharacterIDError,
 )
 
 
@@ -17,6 +18,7 @@ def manager():
 
     manager = CharactersDatabase(use_test=True)
     yield manager  # This will return the SQL object to the test functions
+    manager.close()
 
     # don't delete the test database so it can be inspected later
 
@@ -42,6 +44,26 @@ def test_create_duplicate_character(manager: CharactersDatabase):
         manager.create_character("duplicate_character", 400)
 
 
+def test_create_characters(manager: CharactersDatabase):
+    manager.create_characters([("bulk_char_1", 100), ("Bulk_Char_2", 200)])
+    assert manager.load_character("bulk_char_1")["owner"] == 100
+    assert manager.load_character("bulk_char_2")["owner"] == 200
+
+
+def test_create_characters_is_all_or_nothing(manager: CharactersDatabase):
+    manager.create_character("bulk_existing_char", 100)
+    with pytest.raises(DuplicateCharacterError):
+        manager.create_characters([("bulk_new_char", 100), ("bulk_existing_char", 100)])
+    assert manager.load_character("bulk_new_char") is None
+
+
+@pytest.mark.parametrize("char_id", ["", "has space", "has-dash", "trailing_newline\n"])
+def test_create_invalid_character(manager: CharactersDatabase, char_id: str):
+    with pytest.raises(InvalidCharacterIDError):
+        manager.create_character(char_id, 100)
+    assert manager.load_character(char_id) is None
+
+
 @pytest.mark.dependency(depends=["test_create_character"])
 def test_load_forbidden_character(manager: CharactersDatabase):
     manager.create_character("test_load_forbidden_character", 100)
@@ -192,6 +214,24 @@ def test_list_server(manager: CharactersDatabase):
     assert char_list[1]["description"] is None
 
 
+def test_list_user_pages(manager: CharactersDatabase):
+    char_ids = [f"list_user_page_char_{i}" for i in range(7)]
+    manager.create_characters([(char_id, 700) for char_id in char_ids])
+
+    first_page = manager.list_user_characters(700)
+    assert [char["id"] for char in first_page] == char_ids[:5]
+
+    second_page = manager.list_user_characters(700, after_id=first_page[-1]["id"])
+    assert [char["id"] for char in second_page] == char_ids[5:]
+
+
 def test_own_invalid_character(manager: CharactersDatabase):
     with pytest.raises(CharacterNotFoundError):
         manager.is_character_owner("invalid_character", user_id=500)
+
+
+def test_close_twice():
+    database = CharactersDatabase(use_test=True)
+    database.close()
+    # closing again does nothing rather than failing on the closed connection
+    database.close()
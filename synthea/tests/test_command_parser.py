@@ -0,0 +1,59 @@
+# pylint: disable=missing-function-docstring, redefined-outer-name, line-too-long
+import argparse
+import pytest
+from synthea.CommandParser import ChatbotParser, CommandError, ParserExitedException
+
+
+@pytest.fixture(scope="module")
+def parser():
+    return ChatbotParser()
+
+
+def test_is_command(parser: ChatbotParser):
+    assert parser.is_command("!syn hello")
+    assert parser.is_command("!SYN hello")
+    assert not parser.is_command("hello !syn")
+
+
+def test_parse_prompt_only(parser: ChatbotParser):
+    args = parser.parse("!syn tell me a story -c narrator")
+    assert args.prompt == "tell me a story -c narrator"
+    assert not args.character
+    assert not args.use_as_system_prompt
+    assert not args.use_image_model
+
+
+def test_parse_empty_command(parser: ChatbotParser):
+    assert parser.parse("!syn ").prompt == ""
+
+
+def test_parse_options(parser: ChatbotParser):
+    args = parser.parse("!syn -c narrator -sp tell me a story")
+    assert args.character == "narrator"
+    assert args.use_as_system_prompt
+    assert not args.use_image_model
+    assert args.prompt == "tell me a story"
+
+
+def test_parse_long_options(parser: ChatbotParser):
+    args = parser.parse("!syn --use-image-model --character narrator what is this?")
+    assert args.character == "narrator"
+    assert args.use_image_model
+    assert args.prompt == "what is this?"
+
+
+def test_parse_invalid_options(parser: ChatbotParser):
+    with pytest.raises(argparse.ArgumentError):
+        parser.parse("!syn -c")
+    with pytest.raises(CommandError):
+        parser.parse("!syn -x hello")
+
+
+def test_parse_keeps_line_breaks(parser: ChatbotParser):
+    assert parser.parse("!syn fix this:\n```\nx = 1\n```").prompt == "fix this:\n```\nx = 1\n```"
+    assert parser.parse("!syn -sp be terse.\n\nuse lists.").prompt == "be terse.\n\nuse lists."
+
+
+def test_parse_help(parser: ChatbotParser):
+    with pytest.raises(ParserExitedException):
+        parser.parse("!syn -h")
@@ -0,0 +1,51 @@
+# pylint: disable=missing-function-docstring
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+
+discord = pytest.importorskip("discord")
+
+# pylint: disable-next=wrong-import-position
+from synthea.MessageCache import MessageCache
+
+
+def make_reply(cached_message=None, resolved=None) -> MagicMock:
+    reply = MagicMock()
+    reply.reference.cached_message = cached_message
+    reply.reference.resolved = resolved
+    reply.reference.message_id = 2
+    reply.channel.id = 1
+    reply.channel.fetch_message = AsyncMock(return_value="fetched")
+    return reply
+
+
+def test_replied_message_prefers_discord_cache():
+    resolved = MagicMock(spec=discord.Message)
+    reply = make_reply(cached_message="cached", resolved=resolved)
+
+    assert asyncio.run(MessageCache().fetch_replied_message(reply)) == "cached"
+    reply.channel.fetch_message.assert_not_awaited()
+
+
+def test_replied_message_uses_resolved_copy():
+    resolved = MagicMock(spec=discord.Message)
+    reply = make_reply(resolved=resolved)
+
+    assert asyncio.run(MessageCache().fetch_replied_message(reply)) is resolved
+    reply.channel.fetch_message.assert_not_awaited()
+
+
+def test_deleted_replied_message_is_none():
+    reply = make_reply(resolved=MagicMock(spec=discord.DeletedReferencedMessage))
+
+    assert asyncio.run(MessageCache().fetch_replied_message(reply)) is None
+    reply.channel.fetch_message.assert_not_awaited()
+
+
+def test_replied_message_is_fetched_once():
+    cache = MessageCache()
+    reply = make_reply()
+
+    assert asyncio.run(cache.fetch_replied_message(reply)) == "fetched"
+    assert asyncio.run(cache.fetch_replied_message(reply)) == "fetched"
+    reply.channel.fetch_message.assert_awaited_once_with(2)
@@ -0,0 +1,63 @@
+# pylint: disable=missing-function-docstring, redefined-outer-name, line-too-long
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+
+discord = pytest.importorskip("discord")
+
+# pylint: disable-next=wrong-import-position
+from synthea import SyntheaClient as client_module
+
+
+@pytest.fixture
+def client():
+    # stream_response only needs these, so the client is made without logging in or loading models
+    client = client_module.SyntheaClient.__new__(client_module.SyntheaClient)
+    client.allowed_mentions_reply = discord.AllowedMentions.none()
+    client.allowed_mentions_none = discord.AllowedMentions.none()
+    client._preprocess_response = lambda response: response
+    return client
+
+
+def make_message() -> MagicMock:
+    message = MagicMock()
+    message.delete = AsyncMock()
+    message.edit = AsyncMock()
+    message.add_reaction = AsyncMock()
+    return message
+
+
+async def failing_stream(parts: list[str]):
+    for part in parts:
+        yield part
+    raise ConnectionError("the stream dropped")
+
+
+def test_failed_stream_deletes_placeholder(client):
+    placeholder = make_message()
+    message_to_reply = MagicMock()
+    message_to_reply.reply = AsyncMock(return_value=placeholder)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(client.stream_response(failing_stream(["Hello"]), discord.Embed(), message_to_reply))
+
+    placeholder.delete.assert_awaited_once()
+    placeholder.add_reaction.assert_not_awaited()
+
+
+def test_failed_stream_deletes_continuations(client, monkeypatch):
+    # show every part as soon as it arrives, so the response spills into a second message
+    monkeypatch.setattr(client_module, "STREAM_EDIT_INTERVAL", 0)
+    placeholder = make_message()
+    continuation = make_message()
+    message_to_reply = MagicMock()
+    message_to_reply.reply = AsyncMock(return_value=placeholder)
+    message_to_reply.channel.send = AsyncMock(return_value=continuation)
+
+    long_part = "word " * (client_module.DISCORD_EMBED_LIMIT // 4)
+    with pytest.raises(ConnectionError):
+        asyncio.run(client.stream_response(failing_stream([long_part]), discord.Embed(), message_to_reply))
+
+    message_to_reply.channel.send.assert_awaited_once()
+    placeholder.delete.assert_awaited_once()
+    continuation.delete.assert_awaited_once()
@@ -0,0 +1,31 @@
+# pylint: disable=missing-function-docstring, line-too-long
+from synthea.SyntheaUtilities import split_text_smartly
+
+
+def test_split_empty_text():
+    assert split_text_smartly("") == []
+
+
+def test_split_respects_max_length():
+    text = "\n".join(f"This is sentence number {i}. It is followed by another one." for i in range(200))
+    pieces = split_text_smartly(text, 500)
+    assert len(pieces) > 1
+    assert all(len(piece) <= 500 for piece in pieces)
+
+
+def test_split_long_word():
+    assert split_text_smartly("a" * 45, 40) == ["a" * 40, "a" * 5]
+
+
+def test_split_keeps_code_blocks_balanced():
+    text = "Here is the code:\n```python\n" + "\n".join(f"x = {i}" for i in range(300)) + "\n```\nThat's all."
+    pieces = split_text_smartly(text, 500)
+    assert len(pieces) > 1
+    assert all(len(piece) <= 500 for piece in pieces)
+    assert all(piece.count("```") % 2 == 0 for piece in pieces)
+    assert pieces[1].startswith("```python\n")
+
+
+def test_split_code_block_without_overflow():
+    text = "```\n" + "a" * 30 + "\n```\n" + "b" * 30
+    assert split_text_smartly(text, 40) == ["```\n" + "a" * 30 + "\n```", "b" * 30]